@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# benchmark.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# headless benchmarks of git-age on a generated repository.
+# results are written as JSON, to compare between versions:
+#
+#   bench/benchmark.py -o before.json
+#   ... change things ...
+#   bench/benchmark.py -o after.json --compare before.json
+#
+import sys, os, time, random, shutil, tempfile, subprocess, threading
+import json
+import BaseHTTPServer, SocketServer
+from optparse import OptionParser
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOPDIR)
+from gitage.blame import BlamedFile
+from gitage import gravatar
+
+FILENAME = 'bench.txt'
+SCREEN = 60 # lines painted per expose
+
+def make_repo(path, lines, commits, authors, seed=0):
+    """Creates a git repository at path where FILENAME has
+    about lines lines, written by commits commits from
+    authors authors, using git fast-import."""
+    rand = random.Random(seed)
+    subprocess.check_call(['git', 'init', '-q', path])
+    subprocess.check_call(['git', 'symbolic-ref', 'HEAD', 'refs/heads/master'], cwd=path)
+    p = subprocess.Popen(['git', 'fast-import', '--quiet'], stdin=subprocess.PIPE, cwd=path)
+    text = ['line %d' % i for i in range(lines)]
+    when = 1200000000
+    for i in range(commits):
+        if i:
+            for _ in range(rand.randint(1, 4)):
+                start = rand.randrange(len(text))
+                n = rand.randint(1, 20)
+                op = rand.random()
+                if op < 0.6:
+                    text[start:start+n] = ['commit %d line %d' % (i, k) for k in range(len(text[start:start+n]))]
+                elif op < 0.8 or len(text) < lines // 2:
+                    text[start:start] = ['commit %d new %d' % (i, k) for k in range(n)]
+                else:
+                    del text[start:start+n]
+        when += rand.randint(600, 5 * 86400)
+        a = rand.randrange(authors)
+        data = '\n'.join(text) + '\n'
+        message = 'commit %d\n' % i
+        ident = 'Author %d <author%d@example.com> %d +0000' % (a, a, when)
+        p.stdin.write('commit refs/heads/master\n')
+        p.stdin.write('author %s\ncommitter %s\n' % (ident, ident))
+        p.stdin.write('data %d\n%s' % (len(message), message))
+        p.stdin.write('M 644 inline %s\ndata %d\n%s\n' % (FILENAME, len(data), data))
+    p.stdin.close()
+    if p.wait() != 0:
+        raise RuntimeError("git fast-import failed")
+    subprocess.check_call(['git', 'checkout', '-q', '-f', 'master'], cwd=path)
+    return os.path.join(path, FILENAME)
+
+def timed(func, repeat):
+    """Returns the best wall time of repeat calls of func."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def bench_blame(fil, repeat):
+    """Times git blame plus parsing, and the parsing alone."""
+    results = {}
+    results['blame_seconds'] = timed(lambda: BlamedFile(fil).run(), repeat)
+
+    out = subprocess.Popen(['git', 'blame', '--incremental', '--', FILENAME],
+                           stdout=subprocess.PIPE, cwd=os.path.dirname(fil)).communicate()[0]
+    def parse():
+        blamed = BlamedFile(fil)
+        for i in xrange(0, len(out), 65536):
+            blamed.feed(out[i:i+65536])
+        blamed.finish()
+    results['parse_seconds'] = timed(parse, repeat)
+    return results
+
+def bench_memory(fil):
+    """Runs the blame in a child process, for a clean peak
+    resident size. Returns kilobytes (bytes on Mac OS X)."""
+    code = ("import sys, resource; sys.path.insert(0, %r); from gitage.blame import BlamedFile; "
+            "BlamedFile(%r).run(); print resource.getrusage(resource.RUSAGE_SELF).ru_maxrss"
+            % (TOPDIR, fil))
+    out = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE).communicate()[0]
+    return {'peak_rss_kb': int(out.split()[-1])}
+
+def paint(blamed, authors, first, count):
+    """The color lookups of an expose of count lines
+    from first, as FileView.on_expose makes them."""
+    colors = 0
+    line_color = blamed.line_color
+    for line in xrange(first, first + count):
+        if line_color(line, authors):
+            colors += 1
+    return colors
+
+def bench_paint(fil, repeat):
+    """Times a repaint of the whole file and of one screen
+    (update_blame_lines), and toggling an author: the
+    index lookup for the Authors list plus a screen."""
+    blamed = BlamedFile(fil)
+    blamed.run()
+    results = {}
+    results['update_blame_lines_seconds'] = timed(lambda: paint(blamed, set(), 0, SCREEN), repeat)
+    results['paint_file_seconds'] = timed(lambda: paint(blamed, set(), 0, blamed.num_lines), repeat)
+    authors = [stat[0] for stat in blamed.author_stats()]
+    selected = set()
+    def toggle():
+        for author in authors:
+            selected.symmetric_difference_update([author])
+            paint(blamed, selected, blamed.num_lines // 2, SCREEN)
+    results['author_toggle_seconds'] = timed(toggle, repeat) / max(len(authors), 1)
+    results['index_seconds'] = timed(blamed.build_index, repeat)
+    return results
+
+class _AvatarHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = 0
+    image = 'GIF89a' + '\0' * 1024
+
+    def do_GET(self):
+        _AvatarHandler.requests += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/gif')
+        self.send_header('Content-Length', str(len(self.image)))
+        self.send_header('ETag', '"bench"')
+        self.end_headers()
+        self.wfile.write(self.image)
+
+    def log_message(self, *args):
+        pass
+
+class _AvatarServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    # keep-alive connections stay open in their own threads
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the client hangs up its idle connections at exit
+        pass
+
+def bench_avatars(authors, home):
+    """Fetches the gravatar of every author twice from a
+    local stand-in server, with the cache in home."""
+    server = _AvatarServer(('127.0.0.1', 0), _AvatarHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    oldhome = os.environ.get('HOME')
+    os.environ['HOME'] = home
+    gravatar.set_baseurl('http://127.0.0.1:%d/avatar/' % server.server_port)
+    try:
+        emails = ['author%d@example.com' % a for a in range(authors)]
+        results = {}
+        _AvatarHandler.requests = 0
+        start = time.time()
+        for email in emails:
+            gravatar.get(email)
+        results['avatar_cold_seconds'] = time.time() - start
+        start = time.time()
+        for email in emails:
+            gravatar.get(email)
+        results['avatar_warm_seconds'] = time.time() - start
+        lookups = 2 * len(emails)
+        results['avatar_cache_hits'] = lookups - _AvatarHandler.requests
+        results['avatar_cache_hit_ratio'] = float(lookups - _AvatarHandler.requests) / lookups
+    finally:
+        if oldhome is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = oldhome
+        gravatar.close()
+        server.shutdown()
+        server.server_close()
+    return results
+
+def bench_startup(fil, home):
+    """Times a cold git-age --report of the file in a new
+    process, with an empty blame cache, and importing the
+    blame module alone."""
+    results = {}
+    env = dict(os.environ, HOME=home)
+    code = "import sys; sys.path.insert(0, %r); import gitage.blame" % (TOPDIR)
+    start = time.time()
+    subprocess.call([sys.executable, '-c', code], env=env)
+    results['import_seconds'] = time.time() - start
+    start = time.time()
+    null = open(os.devnull, 'w')
+    try:
+        status = subprocess.call([sys.executable, os.path.join(TOPDIR, 'git-age'),
+                                  '--report', '--no-cache', fil],
+                                 stdout=null, stderr=null, env=env)
+    finally:
+        null.close()
+    if status == 0:
+        results['report_startup_seconds'] = time.time() - start
+    else:
+        results['report_startup_seconds'] = None
+    return results
+
+def compare(results, old):
+    """Prints each timing next to the one in old."""
+    for name in sorted(results):
+        new = results[name]
+        before = old.get(name)
+        if isinstance(new, (int, float)) and isinstance(before, (int, float)) and before:
+            print "%-28s %12.6g %12.6g %+7.1f%%" % (name, before, new, 100.0 * (new - before) / before)
+        else:
+            print "%-28s %12s %12s" % (name, before, new)
+
+def main(args):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--lines", type="int", default=5000,
+                      help="lines in the generated file (default %default)")
+    parser.add_option("--commits", type="int", default=500,
+                      help="commits in the generated history (default %default)")
+    parser.add_option("--authors", type="int", default=20,
+                      help="number of authors (default %default)")
+    parser.add_option("--seed", type="int", default=0)
+    parser.add_option("-r", "--repeat", type="int", default=3,
+                      help="runs of each timing, the best is kept (default %default)")
+    parser.add_option("-o", "--output", metavar="FILE",
+                      help="write the results as JSON to FILE")
+    parser.add_option("--compare", metavar="FILE",
+                      help="compare with the results in FILE")
+    parser.add_option("--keep", action="store_true",
+                      help="keep the generated repository")
+    opts, args = parser.parse_args(args)
+
+    tmpdir = tempfile.mkdtemp(prefix='git-age-bench')
+    try:
+        home = os.path.join(tmpdir, 'home')
+        os.mkdir(home)
+        start = time.time()
+        fil = make_repo(os.path.join(tmpdir, 'repo'), opts.lines, opts.commits,
+                        opts.authors, opts.seed)
+        sys.stderr.write("generated %s in %.1fs\n" % (fil, time.time() - start))
+
+        results = {}
+        for name, func in (("blame", lambda: bench_blame(fil, opts.repeat)),
+                           ("memory", lambda: bench_memory(fil)),
+                           ("paint", lambda: bench_paint(fil, opts.repeat)),
+                           ("avatars", lambda: bench_avatars(opts.authors, home)),
+                           ("startup", lambda: bench_startup(fil, home))):
+            sys.stderr.write("%s...\n" % (name))
+            results.update(func())
+    finally:
+        if opts.keep:
+            sys.stderr.write("kept %s\n" % (tmpdir))
+        else:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    output = {'params': {'lines': opts.lines, 'commits': opts.commits,
+                         'authors': opts.authors, 'seed': opts.seed,
+                         'repeat': opts.repeat},
+              'python': sys.version.split()[0],
+              'time': int(time.time()),
+              'results': results}
+    if opts.output:
+        f = open(opts.output, 'w')
+        try:
+            json.dump(output, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    if opts.compare:
+        f = open(opts.compare)
+        try:
+            old = json.load(f)
+        finally:
+            f.close()
+        oldparams = dict(old.get('params', {}), repeat=opts.repeat)
+        if oldparams != output['params']:
+            sys.stderr.write("warning: %s was run with other parameters\n" % (opts.compare))
+        compare(results, old.get('results', {}))
+    elif not opts.output:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        print
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,98 @@
+# avatars.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# fetches gravatars with a small pool of threads,
+# the focused author first, and keeps them decoded.
+#
+import threading, Queue
+import gravatar
+from lru import LRU
+import gtk
+import gobject
+
+FOCUS = 0 # priority of the author under the cursor
+PREFETCH = 1 # priority of the other authors of a file
+
+class GravatarLoader(object):
+    """Fetches gravatars by email in worker threads and
+    decodes them to pixbufs of size x size pixels, keeping
+    the last cachesize in memory. Each email is fetched
+    once, however often it is asked for; asking again with
+    a lower priority number moves it ahead in the queue.
+    callback(email, pixbuf, error) is called from a worker
+    thread when a fetch is done; pixbuf is None and error
+    a message if it failed."""
+    def __init__(self, callback, workers=4, size=80, cachesize=128):
+        self.callback = callback
+        self.workers = workers
+        self.size = size
+        self.pixbufs = LRU(cachesize)
+        self._queue = Queue.PriorityQueue()
+        self._lock = threading.Lock()
+        self._pending = {} # email -> best queued priority
+        self._inflight = set()
+        self._seq = 0
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self.run)
+            t.setDaemon(True)
+            t.start()
+
+    def get(self, email):
+        """Returns the pixbuf of email if already loaded."""
+        return self.pixbufs.get(email)
+
+    def request(self, email, priority=PREFETCH):
+        """Queues email for fetching; lower priority fetches first."""
+        if not email:
+            return
+        self._lock.acquire()
+        try:
+            if email in self.pixbufs or email in self._inflight:
+                return
+            if self._pending.get(email, priority + 1) <= priority:
+                return
+            self._pending[email] = priority
+            self._seq += 1
+            self._queue.put((priority, self._seq, email))
+        finally:
+            self._lock.release()
+
+    def prefetch(self, emails):
+        for email in emails:
+            self.request(email, PREFETCH)
+
+    def run(self):
+        while True:
+            priority, _, email = self._queue.get()
+            self._lock.acquire()
+            try:
+                # an email requeued at a better priority leaves
+                # its old entry behind; skip that one
+                if self._pending.get(email) != priority:
+                    continue
+                del self._pending[email]
+                self._inflight.add(email)
+            finally:
+                self._lock.release()
+            pixbuf, error = self.load(email)
+            self._lock.acquire()
+            try:
+                self._inflight.discard(email)
+                if pixbuf:
+                    self.pixbufs.put(email, pixbuf)
+            finally:
+                self._lock.release()
+            self.callback(email, pixbuf, error)
+
+    def load(self, email):
+        """Fetches and decodes the gravatar of email.
+        Returns (pixbuf, None), or (None, error message)."""
+        try:
+            filename = gravatar.get(email, self.size)
+            return gtk.gdk.pixbuf_new_from_file_at_size(filename, self.size, self.size), None
+        except (IOError, OSError, gobject.GError), e:
+            return None, str(e)
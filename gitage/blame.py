@@ -0,0 +1,632 @@
+# blame.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# parses git blame output into a compact
+# table of hunks and commits, without any GUI.
+#
+import os, subprocess, mmap
+from array import array
+from bisect import bisect_left, bisect_right
+import phases
+import porcelain
+import gitcmd
+import reblame
+
+_MMAPSIZE = 16 * 1024 * 1024 # files this large are mapped instead of read
+_BLOCKSIZE = 1 << 16 # bytes counted at a time by _count_lines
+_CHUNKSIZE = 1 << 20 # bytes per chunk given by chunks()
+
+def _count_lines(data):
+    """Counts the lines of data, a string or an mmap."""
+    newlines = 0
+    for offset in xrange(0, len(data), _BLOCKSIZE):
+        # mmap has no count(); a block is a small copy
+        newlines += data[offset:offset + _BLOCKSIZE].count('\n')
+    if data and data[-1] != '\n':
+        return newlines + 1
+    return newlines
+
+def color_for_age(age, author=False):
+    age = min(max(age, 0), 100)
+    if author:
+        r = 195 - (age/3)
+        g = 247 - (age/3)
+        b = 181 - (age/3)
+    else:
+        r = 255 - (age/3)
+        g = 247 - (age/3)
+        b = 241 - (age/3)
+    return '#%02x%02x%02x'%(r,g,b)
+
+def color_table(author=False):
+    """Returns the (r, g, b) floats of color_for_age
+    for every age, indexed by age."""
+    table = []
+    for age in range(101):
+        color = color_for_age(age, author)
+        table.append(tuple(int(color[i:i+2], 16) / 255.0 for i in (1, 3, 5)))
+    return table
+
+AGE_COLORS = color_table()
+AUTHOR_AGE_COLORS = color_table(author=True)
+# lines outside the time filter
+FILTERED_COLOR = (0.82, 0.82, 0.82)
+
+class BlamedFile(object):
+    class Commit(object):
+        __slots__ = ('sha1', 'author', 'author_mail', 'author_time', 'author_tz',
+                     'committer', 'committer_mail', 'committer_time', 'committer_tz',
+                     'summary', 'boundary')
+        # metadata shared between many commits
+        interned = ('author', 'author_mail', 'author_tz',
+                    'committer', 'committer_mail', 'committer_tz')
+
+        def __init__(self, sha1):
+            self.sha1 = sha1
+            for key in self.__slots__[1:]:
+                setattr(self, key, None)
+        def attrs(self):
+            return dict((key, getattr(self, key)) for key in self.__slots__
+                        if getattr(self, key) is not None)
+        def __repr__(self):
+            return "<%s %s>"%(self.__class__.__name__,
+                              ", ".join("%s = %s" % (key, value) for key, value in self.attrs().iteritems()))
+
+    class Line(object):
+        """A view of one hunk in the hunk table."""
+        __slots__ = ('commit', 'sourceline', 'resultline', 'num_lines', 'index')
+
+        def __init__(self, commit, sourceline, resultline, num_lines, index):
+            self.commit = commit
+            self.sourceline = sourceline
+            self.resultline = resultline
+            self.num_lines = num_lines
+            self.index = index
+        def __repr__(self):
+            return "<Line (%s/%d/%s) %s>" % (self.sourceline, self.resultline, self.num_lines, self.commit)
+
+    class LineList(object):
+        """Read-only sequence of the hunk covering each line."""
+        def __init__(self, blamed):
+            self.blamed = blamed
+        def __len__(self):
+            return self.blamed.num_lines
+        def __getitem__(self, y):
+            if y < 0:
+                y += self.blamed.num_lines
+            if not 0 <= y < self.blamed.num_lines:
+                raise IndexError(y)
+            return self.blamed.hunk(self.blamed.line_hunk[y])
+
+    class RangeIndex(object):
+        """The line ranges (0-based, end exclusive) of each key,
+        sorted and with adjacent ranges merged, and the number
+        of lines per key. Ranges must be added in file order."""
+        def __init__(self):
+            self.starts = {}
+            self.ends = {}
+            self.lines = {}
+
+        def add(self, key, start, end):
+            starts = self.starts.get(key)
+            if starts is None:
+                self.starts[key] = array('i', [start])
+                self.ends[key] = array('i', [end])
+            elif self.ends[key][-1] == start:
+                self.ends[key][-1] = end
+            else:
+                starts.append(start)
+                self.ends[key].append(end)
+            self.lines[key] = self.lines.get(key, 0) + end - start
+
+        def next(self, key, y):
+            """Returns the first line of the next range of key
+            starting after line y, or None."""
+            starts = self.starts.get(key)
+            if not starts:
+                return None
+            i = bisect_right(starts, y)
+            if i < len(starts):
+                return starts[i]
+            return None
+
+        def previous(self, key, y):
+            """Returns the first line of the range of key before
+            the one containing line y, or None."""
+            starts = self.starts.get(key)
+            if not starts:
+                return None
+            i = bisect_right(starts, y) - 1
+            if i >= 0 and self.ends[key][i] > y:
+                i -= 1
+            if i >= 0:
+                return starts[i]
+            return None
+
+    def __init__(self, fil, progress=None, store=None, rev=None, repo=None):
+        self.fil = fil
+        # with rev, fil is blamed as it was in that commit
+        # of repo, and need not exist in the working tree
+        self.rev = rev
+        self.repo = repo
+        # commits may be shared with other files through store
+        if store is None:
+            store = {}
+        self.store = store
+        self.sha1_to_commit = {}
+        self.sha1_to_index = {}
+        self.commits = []
+        # per commit index: age in this file (0 - 100), and the
+        # filename and previous commit lines of git blame
+        self.ages = array('b')
+        self.filenames = {}
+        self.previous = {}
+        self.progress = progress
+        self.text = ''
+        self.process = None
+        self.done = False
+        self.error = None
+        self.oldest = None
+        self.newest = None
+        self._parser = porcelain.HunkParser()
+        self._authorindex = None
+        self._commitindex = None
+        self._authorcommits = None
+        self._timehunks = None
+        self._times = None
+        self._report("\rparsing %s..." % (fil))
+        with phases.phase('read file', file=fil):
+            if rev:
+                self.large = False
+                self.text = self._read_blob()
+            else:
+                self._read_file()
+            self.num_lines = _count_lines(self.text)
+            # the hunk table, one entry per hunk; commit is an index into
+            # self.commits, and num_lines drops to 0 for overwritten hunks
+            self.hunk_commit = array('i')
+            self.hunk_source = array('i')
+            self.hunk_start = array('i')
+            self.hunk_len = array('i')
+            # hunk covering each line, -1 until blamed
+            self.line_hunk = array('i', [-1]) * self.num_lines
+            self.lines = BlamedFile.LineList(self)
+
+    def _read_file(self):
+        """Reads, or maps, the working tree file."""
+        f = open(self.fil, 'rb')
+        try:
+            # a large file stays in the page cache rather than
+            # being copied into memory; its text is read by chunks()
+            # and released with release_text()
+            self.large = os.fstat(f.fileno()).st_size >= _MMAPSIZE
+            if self.large:
+                self.text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.text = f.read()
+        finally:
+            f.close()
+
+    def _read_blob(self):
+        """Returns the file as it was in self.rev. Raises IOError."""
+        path = os.path.relpath(self.fil, self.repo).replace(os.sep, '/')
+        text = gitcmd.output("cat-file", "blob", "%s:%s" % (self.rev, path), cwd=self.repo)
+        if text is None:
+            raise IOError("%s is not in %s" % (path, self.rev))
+        return text
+
+    def chunks(self, size=_CHUNKSIZE):
+        """Yields the text in pieces of about size bytes,
+        each ending at the end of a line."""
+        text = self.text
+        start = 0
+        while start < len(text):
+            end = start + size
+            if end >= len(text):
+                end = len(text)
+            else:
+                cut = text.rfind('\n', start, end)
+                if cut >= 0:
+                    end = cut + 1
+                else:
+                    # a line longer than size
+                    end = text.find('\n', end) + 1 or len(text)
+            yield text[start:end]
+            start = end
+
+    def release_text(self):
+        """Drops the text, once it has been shown."""
+        if self.large and self.text is not None:
+            self.text.close()
+        self.text = None
+
+    def _report(self, msg):
+        if self.progress:
+            self.progress(msg)
+
+    def start(self, ranges=None, moves=False):
+        """Starts git blame in the background, limited to the
+        (first, last) line ranges if given. Its output should
+        be passed to feed()."""
+        self.process = self.spawn(ranges, moves)
+        return self.process
+
+    def spawn(self, ranges=None, moves=False):
+        """Starts a git blame of the (first, last) line ranges,
+        or the whole file, and returns the process. With moves,
+        lines moved or copied within and between files are
+        followed to where they were written (-M -C -C), which
+        is several times slower. Its parsed output should be
+        passed to add_hunks(); any number may run at once."""
+        self._report("\rgit blame --incremental %s" % (self.fil))
+        args = ["git", "blame", "--incremental"]
+        if moves:
+            args += ["-M", "-C", "-C"]
+        for first, last in ranges or ():
+            args.append("-L%d,%d" % (first, last))
+        path = os.path.abspath(self.fil)
+        if self.rev:
+            args += [self.rev, "--", os.path.relpath(path, self.repo)]
+            cwd = self.repo
+        else:
+            args += ["--", os.path.basename(path)]
+            cwd = os.path.dirname(path)
+        return subprocess.Popen(args,
+                                shell=False,
+                                close_fds=True,
+                                cwd=cwd,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+
+    def run(self, ranges=None, moves=False):
+        """Runs git blame to completion."""
+        p = self.start(ranges, moves)
+        for hunk in porcelain.parse(p.stdout):
+            self.add_parsed(hunk)
+        self.finish()
+
+    def feed(self, data):
+        """Parses a chunk of git blame output, of any size.
+        Returns a Line for each hunk it completed."""
+        return self.add_hunks(self._parser.feed(data))
+
+    def add_hunks(self, hunks):
+        """Adds hunks from porcelain.HunkParser. Returns a
+        Line for each."""
+        lines = []
+        for hunk in hunks:
+            line = self.add_parsed(hunk)
+            if line:
+                lines.append(line)
+        return lines
+
+    def add_parsed(self, hunk):
+        """Adds a hunk from porcelain.HunkParser and the
+        metadata of its commit. Returns its Line, or None."""
+        sha1, sourceline, resultline, num_lines, attrs = hunk
+        commit = self.sha1_to_commit.get(sha1)
+        if commit is None:
+            commit = self._new_commit(sha1)
+        c = self.sha1_to_index[sha1]
+        self.filenames[c] = attrs.pop('filename', None)
+        if attrs:
+            # metadata comes with the first hunk of each commit
+            if 'previous' in attrs:
+                self.previous[c] = attrs.pop('previous')
+            for key, value in attrs.iteritems():
+                setattr(commit, key, value)
+            if 'author_time' in attrs:
+                self.update_range(commit)
+                self.update_age(c)
+        h = self.add_hunk(commit, sourceline, resultline, num_lines)
+        phases.recorder.hunk(num_lines)
+        return self.hunk(h)
+
+    def finish(self):
+        """Called when git blame is done. Recalculates the
+        age of every commit against the final time range."""
+        for hunk in self._parser.close():
+            self.add_parsed(hunk)
+        if self.process:
+            if self.process.wait() != 0:
+                self.error = self.process.stderr.read().strip()
+        self._report('...OK.\n')
+        self.done = True
+        with phases.phase('finish', file=self.fil, commits=len(self.commits)):
+            for commit in self.commits:
+                self.update_range(commit)
+            for c in range(len(self.commits)):
+                self.update_age(c)
+
+    def update_range(self, commit):
+        if commit.author_time is not None:
+            if self.oldest is None or self.oldest > commit.author_time:
+                self.oldest = commit.author_time
+            if self.newest is None or self.newest < commit.author_time:
+                self.newest = commit.author_time
+
+    def update_age(self, c):
+        """Calculates the age (0 - 100 where 100 is oldest and 0 is newest)
+        of commit number c from the commit times seen so far."""
+        commit = self.commits[c]
+        if self.oldest != self.newest and commit.author_time is not None:
+            self.ages[c] = 100 - int(100 * (commit.author_time - self.oldest)) / (self.newest - self.oldest)
+        else:
+            self.ages[c] = 100
+
+    def line_color(self, line, authors=(), since=None, until=None):
+        """Returns the (r, g, b) background of line (0-based):
+        by the age of its commit, in the author colors if the
+        author is in authors, gray if its time is outside since
+        and until. None if the line is not blamed yet."""
+        if line >= self.num_lines:
+            return None
+        h = self.line_hunk[line]
+        if h < 0:
+            return None
+        c = self.hunk_commit[h]
+        commit = self.commits[c]
+        t = commit.author_time or 0
+        if (since is not None and t < since) or (until is not None and t > until):
+            return FILTERED_COLOR
+        if commit.author in authors:
+            return AUTHOR_AGE_COLORS[self.ages[c]]
+        return AGE_COLORS[self.ages[c]]
+
+    def dump(self):
+        """Returns the parsed blame as plain data for the cache."""
+        commits = []
+        for c, commit in enumerate(self.commits):
+            attrs = commit.attrs()
+            if c in self.filenames:
+                attrs['filename'] = self.filenames[c]
+            if c in self.previous:
+                attrs['previous'] = self.previous[c]
+            commits.append(attrs)
+        return {'commits': commits,
+                'hunks': [(self.hunk_commit[h], self.hunk_source[h], self.hunk_start[h], self.hunk_len[h])
+                          for h in self.hunk_indices()]}
+
+    def load(self, data):
+        """Fills in the blame from data returned by dump()."""
+        commits = [self.add_commit(attrs) for attrs in data['commits']]
+        for i, sourceline, resultline, num_lines in data['hunks']:
+            self.add_hunk(commits[i], sourceline, resultline, num_lines)
+        self.finish()
+
+    def add_commit(self, attrs):
+        """Adds a commit with the given metadata, unless known."""
+        commit = self.sha1_to_commit.get(attrs['sha1'])
+        if not commit:
+            commit = self._new_commit(attrs['sha1'])
+            for key, value in attrs.iteritems():
+                if key in BlamedFile.Commit.interned:
+                    value = intern(value)
+                if key in BlamedFile.Commit.__slots__:
+                    setattr(commit, key, value)
+            c = self.sha1_to_index[commit.sha1]
+            if 'filename' in attrs:
+                self.filenames[c] = intern(attrs['filename'])
+            if 'previous' in attrs:
+                self.previous[c] = attrs['previous']
+        return commit
+
+    def add_hunk(self, commit, sourceline, resultline, num_lines):
+        """Adds a hunk to the table, trimming any hunks it
+        overwrites. Returns the index of the new hunk."""
+        start = resultline - 1
+        end = min(start + num_lines, self.num_lines)
+        if start >= end:
+            return -1
+        line_hunk = self.line_hunk
+        if max(line_hunk[start:end]) < 0:
+            # nothing to overwrite, as in a first blame
+            h = self._append_hunk(self.sha1_to_index[commit.sha1], sourceline, resultline, end - start)
+            line_hunk[start:end] = array('i', [h]) * (end - start)
+            self._authorindex = None
+            self._timehunks = None
+            return h
+        # a hunk sticking out after the new one keeps its tail
+        last = line_hunk[end - 1]
+        if last >= 0 and self.hunk_start[last] - 1 + self.hunk_len[last] > end:
+            tail = self.hunk_start[last] - 1 + self.hunk_len[last]
+            h = self._append_hunk(self.hunk_commit[last],
+                                  self.hunk_source[last] + end - (self.hunk_start[last] - 1),
+                                  end + 1, tail - end)
+            for y in range(end, tail):
+                line_hunk[y] = h
+        # a hunk starting before the new one keeps its head
+        first = line_hunk[start]
+        if first >= 0 and self.hunk_start[first] - 1 < start:
+            self.hunk_len[first] = start - (self.hunk_start[first] - 1)
+        for old in set(line_hunk[start:end]):
+            if old >= 0 and old != first and self.hunk_start[old] - 1 >= start:
+                self.hunk_len[old] = 0
+        h = self._append_hunk(self.sha1_to_index[commit.sha1], sourceline, resultline, end - start)
+        line_hunk[start:end] = array('i', [h]) * (end - start)
+        self._authorindex = None
+        self._timehunks = None
+        return h
+
+    def _append_hunk(self, c, sourceline, resultline, num_lines):
+        self.hunk_commit.append(c)
+        self.hunk_source.append(sourceline)
+        self.hunk_start.append(resultline)
+        self.hunk_len.append(num_lines)
+        return len(self.hunk_len) - 1
+
+    def _new_commit(self, sha1):
+        commit = self.store.get(sha1)
+        if not commit:
+            commit = BlamedFile.Commit(sha1)
+            self.store[sha1] = commit
+        self.ages.append(100)
+        self.sha1_to_index[sha1] = len(self.commits)
+        self.sha1_to_commit[sha1] = commit
+        self.commits.append(commit)
+        return commit
+
+    def hunk(self, h):
+        """Returns a Line view of hunk number h, or None."""
+        if h < 0:
+            return None
+        return BlamedFile.Line(self.commits[self.hunk_commit[h]], self.hunk_source[h],
+                               self.hunk_start[h], self.hunk_len[h], h)
+
+    def hunk_indices(self):
+        """Iterates over the live hunk numbers, in file order."""
+        y = 0
+        line_hunk = self.line_hunk
+        while y < self.num_lines:
+            h = line_hunk[y]
+            if h >= 0:
+                yield h
+                y = self.hunk_start[h] - 1 + self.hunk_len[h]
+            else:
+                y += 1
+
+    def hunks(self):
+        """Iterates over each blamed hunk once, in file order."""
+        for h in self.hunk_indices():
+            yield self.hunk(h)
+
+    def build_index(self):
+        """Indexes the line ranges of each author and commit,
+        in one pass over the hunk table. Done on first use
+        after the table changed."""
+        authors = BlamedFile.RangeIndex()
+        commits = BlamedFile.RangeIndex()
+        authorcommits = {}
+        for h in self.hunk_indices():
+            c = self.hunk_commit[h]
+            author = self.commits[c].author
+            start = self.hunk_start[h] - 1
+            end = start + self.hunk_len[h]
+            authors.add(author, start, end)
+            commits.add(c, start, end)
+            authorcommits.setdefault(author, set()).add(c)
+        self._authorindex = authors
+        self._commitindex = commits
+        self._authorcommits = authorcommits
+
+    def _indexes(self):
+        if self._authorindex is None:
+            self.build_index()
+        return self._authorindex, self._commitindex
+
+    def author_stats(self):
+        """Returns (author, lines, commits) for each author,
+        counting only the lines and commits still blamed."""
+        authors, _ = self._indexes()
+        return [(author, lines, len(self._authorcommits[author]))
+                for author, lines in authors.lines.iteritems()]
+
+    def _time_index(self):
+        if self._timehunks is None:
+            commits = self.commits
+            hunk_commit = self.hunk_commit
+            hunks = sorted(self.hunk_indices(),
+                           key=lambda h: commits[hunk_commit[h]].author_time or 0)
+            self._timehunks = array('i', hunks)
+            self._times = array('d', [commits[hunk_commit[h]].author_time or 0 for h in hunks])
+        return self._timehunks, self._times
+
+    def hunks_between(self, t0, t1):
+        """Returns the numbers of the hunks with an author
+        time in [min(t0, t1), max(t0, t1)), found by bisection
+        in a time-sorted index of the hunks."""
+        hunks, times = self._time_index()
+        if t0 > t1:
+            t0, t1 = t1, t0
+        return hunks[bisect_left(times, t0):bisect_left(times, t1)]
+
+    def _step(self, y, author, forward):
+        h = self.line_hunk[y]
+        if h < 0:
+            return None
+        authors, commits = self._indexes()
+        c = self.hunk_commit[h]
+        if author:
+            index, key = authors, self.commits[c].author
+        else:
+            index, key = commits, c
+        if forward:
+            return index.next(key, y)
+        return index.previous(key, y)
+
+    def next_line(self, y, author=False):
+        """Returns the first line (0-based) of the next block
+        of lines from the commit, or author, of line y, or None."""
+        return self._step(y, author, True)
+
+    def previous_line(self, y, author=False):
+        """Like next_line, going backwards."""
+        return self._step(y, author, False)
+
+    def neighbour_hunks(self, y, count=5):
+        """Returns the numbers of up to count hunks
+        before and after the hunk at line y (0-based)."""
+        line_hunk = self.line_hunk
+        hunks = []
+        h = line_hunk[y]
+        if h < 0:
+            return hunks
+        after = self.hunk_start[h] - 1 + self.hunk_len[h]
+        before = self.hunk_start[h] - 2
+        for _ in range(count):
+            while after < self.num_lines and line_hunk[after] < 0:
+                after += 1
+            if after < self.num_lines:
+                n = line_hunk[after]
+                hunks.append(n)
+                after = self.hunk_start[n] - 1 + self.hunk_len[n]
+            while before >= 0 and line_hunk[before] < 0:
+                before -= 1
+            if before >= 0:
+                n = line_hunk[before]
+                hunks.append(n)
+                before = self.hunk_start[n] - 2
+        return hunks
+
+    def unblamed_ranges(self, start, end, maxranges=reblame.MAXRANGES):
+        """Returns the (first, last) line ranges, 1-based as for
+        git blame -L, of the lines not blamed yet from line start
+        up to end (0-based, end exclusive). Beyond maxranges,
+        ranges are joined across the smallest blamed gaps."""
+        ranges = []
+        line_hunk = self.line_hunk
+        end = min(end, self.num_lines)
+        y = max(start, 0)
+        while y < end:
+            if line_hunk[y] >= 0:
+                # skip the rest of the hunk at once
+                h = line_hunk[y]
+                y = self.hunk_start[h] - 1 + self.hunk_len[h]
+                continue
+            first = y
+            while y < end and line_hunk[y] < 0:
+                y += 1
+            ranges.append((first + 1, y))
+        return reblame.coalesce(ranges, maxranges)
+
+    def commit_at(self, y):
+        """Returns the commit blamed for line y (0-based), or None."""
+        h = self.line_hunk[y]
+        if h < 0:
+            return None
+        return self.commits[self.hunk_commit[h]]
+
+    def parent_of(self, commit):
+        """Returns (rev, path) of the file before commit
+        changed it, path relative to the repository, or
+        None for lines that were never changed before."""
+        previous = self.previous.get(self.sha1_to_index.get(commit.sha1))
+        if not previous:
+            return None
+        rev, _, path = previous.partition(' ')
+        return rev, path
+
+    def get_commit(self, sha1):
+        return self.sha1_to_commit.get(sha1)
@@ -0,0 +1,171 @@
+# cache.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# on-disk cache of parsed blame results, keyed by
+# repository, path, HEAD commit and working tree blob.
+#
+import os
+import cPickle as pickle
+import diskcache
+import gitcmd
+try:
+    from hashlib import sha1
+except ImportError:
+    import sha as shalib
+    sha1 = shalib.new
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_BASEPATH = "~/.cache/git-age/blame"
+_MAXSIZE = 256 * 1024 * 1024 # total bytes kept on disk
+_EVICTEVERY = _MAXSIZE // 32 # bytes a process writes between evictions
+_VERSION = 1
+# bytes written since the last eviction; each process
+# evicts at its first store, as it may not write much
+_written = _EVICTEVERY
+
+def _cachedir():
+    return os.path.expanduser(_BASEPATH)
+
+def _makename(key):
+    return os.path.join(_cachedir(), key)
+
+def identify(fil, rev=None, repo=None):
+    """Identifies the content blamed for fil at rev (HEAD plus
+    working tree if rev is None). Returns a dict with repo, path,
+    head and blob, or None if the file is not in a git repository.
+    repo is needed for a fil that is not in the working tree."""
+    fil = os.path.abspath(fil)
+    cwd = repo or os.path.dirname(fil)
+    out = gitcmd.output("rev-parse", "--show-toplevel", rev or "HEAD", cwd=cwd)
+    if not out:
+        return None
+    # one per line, as the path may have spaces in it
+    repo, head = out.splitlines()
+    path = os.path.relpath(fil, repo)
+    if rev:
+        blob = gitcmd.output("rev-parse", "%s:%s" % (head, path.replace(os.sep, '/')), cwd=repo)
+    else:
+        blob = gitcmd.output("hash-object", "--", fil, cwd=repo)
+    if not blob:
+        return None
+    return {'repo': repo, 'path': path, 'head': head, 'blob': blob.strip()}
+
+def _digest(*parts):
+    return sha1("\0".join((str(_VERSION),) + parts)).hexdigest()
+
+def key_for(ident, moves=False):
+    """Returns the cache key for an identity from identify(),
+    of the blame with moved and copied lines followed if moves."""
+    if not ident:
+        return None
+    if moves:
+        return _digest('moves', ident['repo'], ident['path'], ident['head'], ident['blob'])
+    return _digest(ident['repo'], ident['path'], ident['head'], ident['blob'])
+
+def _pathkey(ident):
+    return _digest('latest', ident['repo'], ident['path'])
+
+def load_previous(ident):
+    """Returns (identity, data) of the most recently stored
+    blame of the same path, possibly at another revision,
+    or None."""
+    if not ident:
+        return None
+    previous = load(_pathkey(ident))
+    if not previous:
+        return None
+    data = load(key_for(previous))
+    if not data:
+        return None
+    return previous, data
+
+def load(key):
+    """Returns the cached data for key, or None."""
+    if not key:
+        return None
+    filename = _makename(key)
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            data = pickle.load(f)
+        finally:
+            f.close()
+    except Exception:
+        # truncated or from an incompatible version
+        diskcache.remove(filename)
+        return None
+    try:
+        # mark as recently used for eviction
+        os.utime(filename, None)
+    except OSError:
+        pass
+    return data
+
+def contains(key):
+    """Checks for an entry without loading it."""
+    return bool(key) and os.path.exists(_makename(key))
+
+def store(key, data, ident=None):
+    """Atomically writes data to the cache, then evicts
+    old entries if the cache grew too large, checked once
+    enough was written since the last time. If ident is
+    given, the entry is also remembered as the latest
+    blame of its path."""
+    global _written
+    if not key:
+        return
+    size = _write(key, data)
+    if size and ident:
+        size += _write(_pathkey(ident), ident)
+    # eviction stats every entry, too slow to do for
+    # each of the many small ones a report writes
+    _written += size
+    if _written >= _EVICTEVERY:
+        _written = 0
+        evict()
+
+def _write(key, data):
+    """Returns the bytes written, 0 if writing failed."""
+    try:
+        return diskcache.write(_makename(key), pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+    except (IOError, OSError):
+        return 0
+
+def _lock(directory):
+    """Takes the eviction lock without blocking.
+    Returns the open lock file, or None if another
+    process holds it."""
+    if not fcntl:
+        return None
+    try:
+        f = open(os.path.join(directory, '.lock'), 'w')
+    except IOError:
+        return None
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        f.close()
+        return None
+    return f
+
+def evict(maxsize=_MAXSIZE):
+    """Removes least recently used entries until
+    the cache is smaller than maxsize bytes."""
+    directory = _cachedir()
+    lock = _lock(directory)
+    if fcntl and not lock:
+        return
+    try:
+        # loading an entry touches its modification time
+        diskcache.evict(directory, maxsize)
+    finally:
+        if lock:
+            lock.close()
@@ -0,0 +1,180 @@
+# catfile.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# commit details read through one long-lived
+# git cat-file --batch process.
+#
+import subprocess, threading
+import Queue
+from lru import LRU
+
+_MAXFILES = 200 # changed files listed per commit
+_UNCOMMITTED = '0' * 40
+
+class CatFile(object):
+    """A running git cat-file --batch process."""
+    def __init__(self, cwd):
+        # started from a loader thread; without close_fds it keeps
+        # the pipes of processes other threads start meanwhile open
+        self.process = subprocess.Popen(["git", "cat-file", "--batch"],
+                                        shell=False,
+                                        close_fds=True,
+                                        cwd=cwd,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+
+    def read(self, sha1):
+        """Returns (type, data) of an object, or (None, None)
+        if it does not exist."""
+        self.process.stdin.write(sha1 + '\n')
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+        if len(header) != 3:
+            return None, None
+        data = self.process.stdout.read(int(header[2]))
+        self.process.stdout.read(1) # trailing newline
+        return header[1], data
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+class CommitDetails(object):
+    __slots__ = ('sha1', 'tree', 'parents', 'author', 'committer', 'message', 'files')
+
+    def __init__(self, sha1):
+        self.sha1 = sha1
+        self.tree = None
+        self.parents = []
+        self.author = None
+        self.committer = None
+        self.message = ''
+        self.files = []
+
+def parse_commit(sha1, data):
+    """Parses a raw commit object."""
+    details = CommitDetails(sha1)
+    header, _, details.message = data.partition('\n\n')
+    for line in header.split('\n'):
+        key, _, value = line.partition(' ')
+        if key == 'tree':
+            details.tree = value
+        elif key == 'parent':
+            details.parents.append(value)
+        elif key == 'author':
+            details.author = value
+        elif key == 'committer':
+            details.committer = value
+    return details
+
+def parse_tree(data):
+    """Returns {name: (mode, sha1)} for a raw tree object."""
+    entries = {}
+    pos = 0
+    while pos < len(data):
+        space = data.index(' ', pos)
+        nul = data.index('\0', space)
+        entries[data[space+1:nul]] = (data[pos:space], data[nul+1:nul+21].encode('hex'))
+        pos = nul + 21
+    return entries
+
+class DetailLoader(threading.Thread):
+    """Reads commit details in the background, most urgent
+    first, keeping recently used ones in an LRU cache.
+    callback(details) is called from the loader thread."""
+    def __init__(self, cwd, callback, cachesize=256):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.cwd = cwd
+        self.callback = callback
+        self.cache = LRU(cachesize)
+        self._queue = Queue.PriorityQueue()
+        self._pending = set()
+        self._seq = 0
+        self._catfile = None
+
+    def get(self, sha1):
+        """Returns the details of sha1 if already loaded."""
+        return self.cache.get(sha1)
+
+    def request(self, sha1, priority=0):
+        """Queues sha1 for loading; lower priority loads first."""
+        if sha1 == _UNCOMMITTED or sha1 in self.cache or (priority, sha1) in self._pending:
+            return
+        self._pending.add((priority, sha1))
+        self._seq += 1
+        self._queue.put((priority, self._seq, sha1))
+
+    def run(self):
+        self._catfile = CatFile(self.cwd)
+        while True:
+            priority, _, sha1 = self._queue.get()
+            self._pending.discard((priority, sha1))
+            if sha1 in self.cache:
+                continue
+            try:
+                details = self.load(sha1)
+            except (IOError, ValueError):
+                # the process died or sent garbage; start over
+                self._catfile = CatFile(self.cwd)
+                continue
+            if details:
+                self.cache.put(sha1, details)
+                self.callback(details)
+
+    def load(self, sha1):
+        kind, data = self._catfile.read(sha1)
+        if kind != 'commit':
+            return None
+        details = parse_commit(sha1, data)
+        parent_tree = None
+        if details.parents:
+            kind, data = self._catfile.read(details.parents[0])
+            if kind == 'commit':
+                parent_tree = parse_commit(details.parents[0], data).tree
+        self.diff_trees(parent_tree, details.tree, '', details.files)
+        return details
+
+    def read_tree(self, sha1):
+        """Returns the entries of tree sha1, {} for no sha1,
+        or None if it is not a tree in the repository."""
+        if not sha1:
+            return {}
+        kind, data = self._catfile.read(sha1)
+        if kind != 'tree':
+            return None
+        return parse_tree(data)
+
+    def diff_trees(self, old, new, prefix, files):
+        """Appends (status, path) for the files that differ
+        between two trees, only descending into subtrees
+        that changed."""
+        if old == new or len(files) >= _MAXFILES:
+            return
+        old_entries = self.read_tree(old)
+        new_entries = self.read_tree(new)
+        if old_entries is None or new_entries is None:
+            # missing, as in a shallow clone; list what is known
+            return
+        for name in sorted(set(old_entries) | set(new_entries)):
+            if len(files) >= _MAXFILES:
+                return
+            old_mode, old_sha1 = old_entries.get(name, (None, None))
+            new_mode, new_sha1 = new_entries.get(name, (None, None))
+            if old_sha1 == new_sha1:
+                continue
+            old_tree = old_mode == '40000' and old_sha1 or None
+            new_tree = new_mode == '40000' and new_sha1 or None
+            if old_tree or new_tree:
+                self.diff_trees(old_tree, new_tree, prefix + name + '/', files)
+                if (old_mode and not old_tree) or (new_mode and not new_tree):
+                    # a file replaced by a directory or the reverse
+                    files.append((new_tree and 'D' or 'A', prefix + name))
+            elif not old_sha1:
+                files.append(('A', prefix + name))
+            elif not new_sha1:
+                files.append(('D', prefix + name))
+            else:
+                files.append(('M', prefix + name))
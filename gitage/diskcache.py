@@ -0,0 +1,82 @@
+# diskcache.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# atomic writes and least recently used eviction for
+# the files of a cache directory, shared by the blame
+# cache and the gravatar cache.
+#
+import os, time, tempfile
+
+_TMPAGE = 3600 # seconds before a temporary file is taken as left behind
+
+def remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+def write(filename, data):
+    """Writes data to a temporary file next to filename,
+    then renames it into place, so that readers never
+    see a partial file. Returns the bytes written.
+    Raises IOError or OSError."""
+    directory = os.path.dirname(filename)
+    try:
+        os.makedirs(directory)
+    except os.error:
+        pass
+    fd, tmpname = tempfile.mkstemp(prefix='.tmp', dir=directory)
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        if os.name == 'nt':
+            remove(filename)
+        os.rename(tmpname, filename)
+    except:
+        remove(tmpname)
+        raise
+    return len(data)
+
+def evict(directory, maxsize, maxcount=None, atime=False, ignore=None, remove_entry=remove):
+    """Removes the least recently used files of directory until
+    at most maxcount files of maxsize bytes in all are left.
+    Files are used when modified, or accessed with atime.
+    Hidden files, and those ignore(name) is true for, are
+    kept, except for the temporary files of crashed writers.
+    remove_entry(filename) removes an entry."""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    entries = []
+    total = 0
+    now = time.time()
+    for name in names:
+        filename = os.path.join(directory, name)
+        try:
+            st = os.stat(filename)
+        except OSError:
+            continue
+        if name.startswith('.tmp'):
+            if now - st.st_mtime > _TMPAGE:
+                remove(filename)
+            continue
+        if name.startswith('.') or (ignore and ignore(name)):
+            continue
+        entries.append((atime and st.st_atime or st.st_mtime, st.st_size, filename))
+        total += st.st_size
+    count = len(entries)
+    if total <= maxsize and (maxcount is None or count <= maxcount):
+        return
+    entries.sort()
+    for used, size, filename in entries:
+        if total <= maxsize and (maxcount is None or count <= maxcount):
+            break
+        remove_entry(filename)
+        total -= size
+        count -= 1
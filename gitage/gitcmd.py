@@ -0,0 +1,25 @@
+# gitcmd.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# helpers for running git commands
+#
+import subprocess
+
+def output(*args, **kwargs):
+    """Runs git with args and returns its output, or
+    None if it exits with a code not in kwargs['ok']
+    (default: only 0). Safe to call from any thread."""
+    # without close_fds, a git started meanwhile from another
+    # thread would hold our pipe open until it exits
+    p = subprocess.Popen(("git",) + args,
+                         shell=False,
+                         close_fds=True,
+                         cwd=kwargs.get('cwd'),
+                         stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    out, _ = p.communicate()
+    if p.returncode not in kwargs.get('ok', (0,)):
+        return None
+    return out
@@ -2,7 +2,8 @@
 #    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
 #    This is free software, and you are welcome to redistribute it
 #    under certain conditions; see LICENSE for details.
-import os, time, urllib
+import os, time, urllib, urlparse, httplib, socket, threading
+import diskcache
 try:
     from hashlib import md5
 except ImportError:
@@ -11,6 +12,20 @@ except ImportError:
 
 _BASEPATH = "~/.cache/pygravatar/%s_%d"
 _OLDAGE = 24 # age in hours
+_MAXSIZE = 8 * 1024 * 1024 # total bytes kept on disk
+_MAXCOUNT = 2000 # images kept on disk
+_BASEURL = os.environ.get('GRAVATAR_URL', "https://www.gravatar.com/avatar/")
+_TIMEOUT = 10 # seconds per request
+_MAXREDIRECTS = 5
+_REDIRECTS = (301, 302, 303, 307, 308)
+_RETRY = 60 # seconds before retrying a failed fetch, doubled per failure
+_MAXRETRY = 3600
+
+def set_baseurl(url):
+    """Fetches images from url instead of gravatar.com
+    (also settable with the GRAVATAR_URL environment variable)."""
+    global _BASEURL
+    _BASEURL = url
 
 def _makemd5(email):
     return md5(email.lower()).hexdigest()
@@ -26,10 +41,192 @@ def _dirty(filename):
     ex = os.path.exists(filename)
     return not ex or _older(filename, _OLDAGE)
 
+def _touch(filename):
+    # the access time orders eviction, the
+    # modification time is when it was fetched
+    try:
+        st = os.stat(filename)
+        os.utime(filename, (time.time(), st.st_mtime))
+    except OSError:
+        pass
+
+class _ConnectionPool(object):
+    """Keeps idle keep-alive connections per host,
+    shared by all threads."""
+    def __init__(self, maxidle=4):
+        self.maxidle = maxidle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        self._lock.acquire()
+        try:
+            conns = self._idle.get(key)
+            if conns:
+                return conns.pop()
+            return None
+        finally:
+            self._lock.release()
+
+    def _put(self, key, conn):
+        self._lock.acquire()
+        try:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.maxidle:
+                conns.append(conn)
+                return
+        finally:
+            self._lock.release()
+        conn.close()
+
+    def close(self):
+        """Closes the idle connections."""
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = {}
+        finally:
+            self._lock.release()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def request(self, url, headers):
+        """GETs url, following redirects. Returns (status,
+        headers, body), with lowercase header names.
+        Raises IOError."""
+        for hop in range(_MAXREDIRECTS + 1):
+            status, respheaders, body = self._request(url, headers)
+            location = respheaders.get('location')
+            if status not in _REDIRECTS or not location:
+                return status, respheaders, body
+            url = urlparse.urljoin(url, location)
+        raise IOError("fetching %s: too many redirects" % (url))
+
+    def _request(self, url, headers):
+        scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+        if query:
+            path += '?' + query
+        key = (scheme, netloc)
+        for attempt in range(2):
+            conn = self._get(key)
+            reused = conn is not None
+            if not reused:
+                if scheme == 'https':
+                    conn = httplib.HTTPSConnection(netloc, timeout=_TIMEOUT)
+                else:
+                    conn = httplib.HTTPConnection(netloc, timeout=_TIMEOUT)
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                if reused:
+                    # the server closed an idle connection
+                    continue
+                raise IOError("fetching %s: %s" % (url, e))
+            if resp.will_close:
+                conn.close()
+            else:
+                self._put(key, conn)
+            return resp.status, dict(resp.getheaders()), body
+        raise IOError("fetching %s: connection closed" % (url))
+
+_pool = _ConnectionPool()
+
+def close():
+    """Closes the connections kept open for later fetches."""
+    _pool.close()
+
+_failures = {} # filename -> (failed attempts, time of next attempt)
+_failures_lock = threading.Lock()
+
+def _backoff(filename):
+    """Raises IOError if fetching filename failed recently."""
+    _failures_lock.acquire()
+    try:
+        count, retry = _failures.get(filename, (0, 0))
+    finally:
+        _failures_lock.release()
+    if time.time() < retry:
+        raise IOError("not retrying %s for %d seconds" % (filename, retry - time.time()))
+
+def _failed(filename):
+    _failures_lock.acquire()
+    try:
+        count, retry = _failures.get(filename, (0, 0))
+        delay = min(_RETRY * 2 ** count, _MAXRETRY)
+        _failures[filename] = (count + 1, time.time() + delay)
+    finally:
+        _failures_lock.release()
+
+def _succeeded(filename):
+    _failures_lock.acquire()
+    try:
+        _failures.pop(filename, None)
+    finally:
+        _failures_lock.release()
+
+def _metaname(filename):
+    return filename + '.meta'
+
+def _readmeta(filename):
+    """Returns the validators (etag, last-modified) saved
+    with filename, None where missing."""
+    try:
+        f = open(_metaname(filename))
+        try:
+            lines = f.read().split('\n')
+        finally:
+            f.close()
+    except IOError:
+        return None, None
+    lines += ['', '']
+    return lines[0] or None, lines[1] or None
+
+def _fetch(url, filename):
+    """Fetches url into filename. An existing filename is
+    revalidated with the saved ETag and Last-Modified, and
+    only marked fresh if the server answers 304."""
+    _backoff(filename)
+    headers = {}
+    if os.path.exists(filename):
+        etag, modified = _readmeta(filename)
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+    try:
+        status, respheaders, body = _pool.request(url, headers)
+    except IOError:
+        _failed(filename)
+        raise
+    if status == 304:
+        os.utime(filename, None)
+    elif status == 200 and body:
+        diskcache.write(filename, body)
+        diskcache.write(_metaname(filename), "%s\n%s\n" % (respheaders.get('etag', ''),
+                                                          respheaders.get('last-modified', '')))
+    else:
+        _failed(filename)
+        raise IOError("fetching %s: HTTP status %d" % (url, status))
+    _succeeded(filename)
+
+def evict(maxsize=_MAXSIZE, maxcount=_MAXCOUNT):
+    """Removes the least recently used images until
+    at most maxcount images of maxsize bytes are left."""
+    def remove(filename):
+        diskcache.remove(filename)
+        diskcache.remove(_metaname(filename))
+    # the modification time is when an image was fetched
+    diskcache.evict(os.path.dirname(_makename('', 0)), maxsize, maxcount, atime=True,
+                    ignore=lambda name: name.endswith('.meta'), remove_entry=remove)
+
 def _makeurl(emailmd5, size):
     """Constructs the Gravatar URL.
     """
-    gravatar_url =  "http://www.gravatar.com/avatar/"
+    gravatar_url = _BASEURL
     gravatar_url += emailmd5
     gravatar_url += '?' + urllib.urlencode({'d':'monsterid', 's': str(size)})
     return gravatar_url
@@ -39,7 +236,9 @@ def get(email = "someone@example.com",
     """Looks in local cache if file exists
     and is newer than TIMEOUT. If not, fetches
     a new image and puts it in the cache.
-    Returns local path to image."""
+    Returns local path to image. Raises IOError
+    if there is no image and fetching it failed;
+    an outdated image is kept if the refresh fails."""
     emailmd5 = _makemd5(email)
     filename = _makename(emailmd5, size)
     if _dirty(filename):
@@ -48,7 +247,15 @@ def get(email = "someone@example.com",
         except os.error:
             pass
         url = _makeurl(emailmd5, size)
-        urllib.urlretrieve(url, filename)
+        try:
+            _fetch(url, filename)
+        except IOError:
+            if not os.path.exists(filename):
+                raise
+        else:
+            evict()
+    else:
+        _touch(filename)
     return filename
 
 if __name__ == "__main__":
@@ -0,0 +1,1601 @@
+# git-age  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# the GTK user interface: shows the file
+# with annotations on author and age etc.
+# per line.
+#
+import sys, os, subprocess, pkgutil
+from optparse import OptionParser
+import avatars
+from avatars import GravatarLoader
+import cache
+import reblame
+from blame import BlamedFile, color_for_age
+import heatmap
+import catfile
+import watch
+from prefetch import Prefetcher
+import phases
+import porcelain
+
+import pygtk
+pygtk.require('2.0')
+import gtk
+import gobject
+import pango
+import gtksourceview2
+import time
+import platform
+
+def progress(msg):
+    sys.stdout.write(msg)
+    sys.stdout.flush()
+
+class CommitTracker(object):
+    def __init__(self):
+        self.current_commit = None
+
+class BlameJob(object):
+    """Runs git blame for a BlamedFile from the main loop,
+    parsing its output as it arrives. A job with a block
+    (start, end) of 0-based lines blames the lines of it
+    that are still unblamed when it starts, so it can give
+    way to other jobs and be started again. With moves, it
+    follows moved and copied lines (see BlamedFile.spawn).
+    error is git's message if it failed."""
+    def __init__(self, blamed, ranges=None, on_hunk=None, on_done=None, block=None, moves=False):
+        self.blamed = blamed
+        self.ranges = ranges
+        self.block = block
+        self.moves = moves
+        self.on_hunk = on_hunk
+        self.on_done = on_done
+        self.priority = 0
+        self.scheduler = None
+        self.process = None
+        self.parser = None
+        self.watch = None
+        self.done = False
+        self.error = None
+        self.span = None
+
+    def start(self):
+        if self.block:
+            # a job aborted halfway keeps what it blamed
+            self.ranges = self.blamed.unblamed_ranges(self.block[0], self.block[1])
+            if not self.ranges:
+                # blamed meanwhile by other jobs
+                self.watch = gobject.idle_add(self.finish)
+                return
+        self.span = phases.phase('git blame', file=self.blamed.fil, ranges=len(self.ranges or ()),
+                                 moves=self.moves)
+        self.parser = porcelain.HunkParser()
+        self.process = self.blamed.spawn(self.ranges, self.moves)
+        self.watch = gobject.io_add_watch(self.process.stdout, gobject.IO_IN | gobject.IO_HUP, self.on_output)
+
+    def cancel(self):
+        """Kills a running git blame. The job can be started again."""
+        if self.watch is None:
+            return
+        gobject.source_remove(self.watch)
+        self.watch = None
+        p = self.process
+        if not p:
+            return
+        try:
+            p.kill()
+        except OSError:
+            pass
+        p.wait()
+        p.stdout.close()
+        p.stderr.close()
+        self.process = None
+        self.parser = None
+        self.span.end()
+
+    def on_output(self, source, condition):
+        data = ''
+        if condition & gobject.IO_IN:
+            data = os.read(source.fileno(), 65536)
+        if not data:
+            self.show_hunks(self.blamed.add_hunks(self.parser.close()))
+            p = self.process
+            if p.wait() != 0:
+                self.error = p.stderr.read().strip()
+            p.stdout.close()
+            p.stderr.close()
+            self.process = None
+            self.span.end()
+            return self.finish()
+
+        with phases.phase('parse', bytes=len(data)):
+            blamelines = self.blamed.add_hunks(self.parser.feed(data))
+        self.show_hunks(blamelines)
+        return True
+
+    def show_hunks(self, blamelines):
+        if self.on_hunk:
+            for blameline in blamelines:
+                self.on_hunk(blameline)
+
+    def finish(self):
+        self.watch = None
+        self.done = True
+        if self.scheduler:
+            self.scheduler.job_finished(self)
+        if self.on_done:
+            self.on_done(self)
+        return False
+
+class BlameScheduler(object):
+    """Runs blame jobs, lowest priority number first. A job
+    waiting for a free slot aborts a running job of lower
+    priority, which is queued to run again later."""
+    def __init__(self, maxjobs=2):
+        self.maxjobs = maxjobs
+        self.queued = []
+        self.running = []
+
+    def submit(self, job, priority):
+        self.submit_all([(job, priority)])
+
+    def submit_all(self, jobs):
+        """Queues (job, priority) pairs before starting any."""
+        for job, priority in jobs:
+            job.priority = priority
+            job.scheduler = self
+            self.queued.append(job)
+        self.schedule()
+
+    def set_priority(self, job, priority):
+        self.set_priorities([(job, priority)])
+
+    def set_priorities(self, jobs):
+        """Changes the priority of (job, priority) pairs."""
+        changed = False
+        for job, priority in jobs:
+            if job.priority != priority:
+                job.priority = priority
+                changed = True
+        if changed:
+            self.schedule()
+
+    def cancel(self, job):
+        if job in self.running:
+            job.cancel()
+            self.running.remove(job)
+        elif job in self.queued:
+            self.queued.remove(job)
+        self.schedule()
+
+    def job_finished(self, job):
+        if job in self.running:
+            self.running.remove(job)
+        self.schedule()
+
+    def schedule(self):
+        while self.queued:
+            self.queued.sort(key=lambda j: j.priority)
+            job = self.queued[0]
+            if len(self.running) >= self.maxjobs:
+                worst = max(self.running, key=lambda j: j.priority)
+                if worst.priority <= job.priority:
+                    break
+                worst.cancel()
+                self.running.remove(worst)
+                self.queued.append(worst)
+            self.queued.remove(job)
+            self.running.append(job)
+            job.start()
+
+class FileView(gtk.ScrolledWindow):
+    """A blamed file, shown in a tab of the main window."""
+    MAXREDRAWS = 64 # hunks redrawn one by one before redrawing it all
+    PROGRESSIVE = 20000 # files with more lines are blamed view first
+    SCREEN = 100 # lines taken to be in view before it is drawn
+    SCROLLDELAY = 150 # ms between re-plans of the blame while scrolling
+
+    def __init__(self, fil, store, rev=None, repo=None):
+        gtk.ScrolledWindow.__init__(self)
+        self.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        self.fil = fil
+        self.store = store
+        # the commit shown, None for the working tree
+        self.rev = rev
+        self.repository = repo
+        self.sourceview = None
+        self.sourcebuffer = None
+        self.blamed = None
+        self.authors = set()
+        # lines by author time outside [since, until] are dimmed
+        self.since = None
+        self.until = None
+        self.ident = None
+        self.cachekey = None
+        self.cachehit = False
+        # queued and running blame jobs, the one blaming the lines
+        # in view ahead of the rest, and the lines it covers
+        self.scheduler = None
+        self.jobs = set()
+        self.focusjob = None
+        self.focuslines = None
+        self.progressive = False
+        self.priority = 0
+        self.on_done = None
+        # first and last line (0-based) in view
+        self.viewport = (0, self.SCREEN)
+        self.scrolltimeout = None
+        # the second pass, following moved and copied lines
+        self.refinejob = None
+        self.refined = False
+        self.refined_lines = 0
+        self.on_refined = None
+        # idle source appending the chunks of a large file
+        self.loader = None
+        self.loadspan = None
+        # lines blamed so far, reported to on_progress(view)
+        self.blamed_lines = 0
+        self.last_progress = 0
+        self.on_progress = None
+
+    def setup(self, langmanager, stylemanager):
+        self.sourcebuffer = gtksourceview2.Buffer()
+        if 'tango' in stylemanager.get_scheme_ids():
+            self.sourcebuffer.set_style_scheme(stylemanager.get_scheme('tango'))
+        with phases.phase('guess language', file=self.fil):
+            self.sourcebuffer.set_language(langmanager.guess_language(self.fil))
+        self.sourceview = gtksourceview2.View(self.sourcebuffer)
+        self.sourceview.set_editable(False)
+        self.sourceview.set_show_line_numbers(True)
+        self.sourceview.modify_font(pango.FontDescription('Monospace'))
+        # line backgrounds are painted for the visible lines only
+        self.sourceview.connect('expose-event', self.on_expose)
+        self.sourceview.connect('key-press-event', self.on_key_press)
+        self.add(self.sourceview)
+        self.get_vadjustment().connect('value-changed', self.on_scroll)
+
+    def load(self):
+        """Reads the file into the view. Raises IOError."""
+        self.blamed = BlamedFile(self.fil, progress, self.store, self.rev, self.repository)
+        self.show_text()
+
+    def show_text(self):
+        if self.blamed.large:
+            # highlighting and undo would cost more than the text
+            self.sourcebuffer.set_highlight_syntax(False)
+            self.sourcebuffer.begin_not_undoable_action()
+            self.sourcebuffer.set_text('')
+            self.loadspan = phases.phase('load chunks', lines=self.blamed.num_lines)
+            self.loader = gobject.idle_add(self.load_chunk, self.blamed.chunks())
+            return
+        with phases.phase('set_text', lines=self.blamed.num_lines):
+            self.sourcebuffer.set_text(self.decode(self.blamed.text))
+        # the buffer keeps its own copy
+        self.blamed.release_text()
+
+    def reload(self, on_done):
+        """Reads the file again after it changed on disk, and
+        blames only what changed since its last blame: the
+        edited lines after a save, and the lines that were not
+        committed yet after a commit. Returns like start_blame.
+        Raises IOError, leaving the view as it was."""
+        previous = None
+        if self.blamed.done and self.ident:
+            previous = (self.ident, self.blamed.dump(), self.shown_text())
+        refined = self.refined
+        line = self.cursor_line()
+        scroll = self.get_vadjustment().get_value()
+        blamed = BlamedFile(self.fil, progress, self.store)
+        self.close()
+        self.blamed = blamed
+        self.blamed_lines = 0
+        self.cachehit = False
+        self.refined = False
+        self.show_text()
+        self.sourcebuffer.place_cursor(self.sourcebuffer.get_iter_at_line(line))
+        # the buffer is laid out again before the view can scroll
+        gobject.idle_add(self.get_vadjustment().set_value, scroll)
+        return self.start_blame(self.scheduler, self.priority, on_done, previous, refined)
+
+    def decode(self, text):
+        if platform.system() == 'Windows':
+            return unicode(text, "iso-8859-1")
+        return text
+
+    def shown_text(self):
+        """Returns the text in the buffer as read from the
+        file, or None while it is still being loaded."""
+        if self.loader:
+            return None
+        start, end = self.sourcebuffer.get_bounds()
+        text = self.sourcebuffer.get_text(start, end, True)
+        if platform.system() == 'Windows':
+            return unicode(text, "utf-8").encode("iso-8859-1")
+        return text
+
+    def load_chunk(self, chunks):
+        """Appends the next chunk of a large file to the
+        buffer, one per main loop iteration."""
+        for chunk in chunks:
+            self.sourcebuffer.insert(self.sourcebuffer.get_end_iter(), self.decode(chunk))
+            return True
+        self.sourcebuffer.end_not_undoable_action()
+        self.sourcebuffer.place_cursor(self.sourcebuffer.get_start_iter())
+        self.blamed.release_text()
+        self.loader = None
+        self.loadspan.end()
+        return False
+
+    def close(self):
+        """Stops loading and blaming the file."""
+        self.cancel_blame()
+        if self.scrolltimeout:
+            gobject.source_remove(self.scrolltimeout)
+            self.scrolltimeout = None
+        if self.loader:
+            gobject.source_remove(self.loader)
+            self.loader = None
+            self.sourcebuffer.end_not_undoable_action()
+            self.blamed.release_text()
+
+    def repo(self):
+        if self.ident:
+            return self.ident['repo']
+        if self.repository:
+            return self.repository
+        return os.path.dirname(os.path.abspath(self.fil))
+
+    def title(self):
+        name = os.path.basename(self.fil)
+        if self.rev:
+            return "%s@%s" % (name, self.rev[:7])
+        return name
+
+    def cursor_line(self):
+        insert = self.sourcebuffer.get_insert()
+        return self.sourcebuffer.get_iter_at_mark(insert).get_line()
+
+    def goto_line(self, line):
+        """Moves the cursor to line (0-based) and shows it."""
+        self.sourcebuffer.place_cursor(self.sourcebuffer.get_iter_at_line(line))
+        self.sourceview.scroll_to_mark(self.sourcebuffer.get_insert(), 0.1, True, 0.0, 0.3)
+        # it may not scroll until drawn, so blame it first now
+        self.viewport = (max(line - self.SCREEN // 3, 0), line + self.SCREEN * 2 // 3)
+        self.focus(*self.viewport)
+
+    def parent_location(self):
+        """Returns (fil, rev, line) of the line under the cursor
+        as it was before the commit blamed for it, or None."""
+        y = self.cursor_line()
+        if not self.blamed or y >= self.blamed.num_lines:
+            return None
+        commit = self.blamed.commit_at(y)
+        parent = commit and self.blamed.parent_of(commit)
+        if not parent:
+            return None
+        rev, path = parent
+        # the line number in the blamed commit is close to
+        # where the line was in its parent
+        h = self.blamed.line_hunk[y]
+        line = self.blamed.hunk_source[h] - 1 + y - (self.blamed.hunk_start[h] - 1)
+        return os.path.join(self.repo(), path), rev, line
+
+    def start_blame(self, scheduler, priority, on_done, previous=None, refined=False):
+        """Fills in what the caches know, and queues blame jobs
+        for the rest of the file on scheduler. on_done(view) is
+        called when they are done. Returns False if nothing
+        is left to blame. previous is an earlier (identity,
+        dump[, text]) of the file to reuse, by default the latest
+        in the cache; refined if it followed moved lines."""
+        self.scheduler = scheduler
+        self.priority = priority
+        self.on_done = on_done
+        with phases.phase('identify', file=self.fil):
+            self.ident = cache.identify(self.fil, self.rev, self.repository)
+            self.cachekey = cache.key_for(self.ident)
+        with phases.phase('cache load'):
+            data = cache.load(cache.key_for(self.ident, moves=True))
+            if data:
+                self.refined = True
+            else:
+                data = cache.load(self.cachekey)
+        if data:
+            self.cachehit = True
+            self.blamed.load(data)
+            return False
+
+        # reuse an earlier blame of the file where it is still valid
+        ranges = None
+        if not previous:
+            with phases.phase('cache load previous'):
+                previous = not self.rev and cache.load_previous(self.ident)
+            refined = False
+        if previous:
+            with phases.phase('reblame'):
+                ranges = reblame.prepare(self.blamed, previous[0], previous[1], self.ident, *previous[2:])
+            if ranges is not None:
+                # the changed lines are blamed the same way
+                self.refined = refined
+                self.update_blame_lines()
+                if not ranges:
+                    return False
+
+        n = self.blamed.num_lines
+        if ranges is None and n > self.PROGRESSIVE:
+            # git blame gives hunks in history order, so the lines in
+            # view get a blame of their own. Each git blame -L walks
+            # the history of the whole file, so the rest is one job
+            # rather than blocks, which would each cost a full blame.
+            self.progressive = True
+            self.focus(*self.viewport)
+            self.submit([BlameJob(self.blamed, None, self.on_hunk, self.job_done, (0, n))])
+        else:
+            # lines are colored as git blame produces them
+            self.submit([BlameJob(self.blamed, ranges, self.on_hunk, self.job_done,
+                                  moves=self.refined)])
+        return True
+
+    def submit(self, jobs):
+        self.jobs.update(jobs)
+        self.scheduler.submit_all([(job, self.job_priority(job)) for job in jobs])
+
+    def job_priority(self, job):
+        """Jobs run at the priority of the view, the rest of a
+        progressive blame after the lines in view, and the
+        refinement after the blames of the other views."""
+        if job is self.refinejob:
+            return self.priority + 1.5
+        if job.block:
+            return self.priority + 0.5
+        return self.priority
+
+    def set_priority(self, priority):
+        self.priority = priority
+        self.reprioritize()
+
+    def reprioritize(self):
+        jobs = list(self.jobs)
+        if self.refinejob:
+            jobs.append(self.refinejob)
+        if jobs:
+            self.scheduler.set_priorities([(job, self.job_priority(job)) for job in jobs])
+
+    def focus(self, first, last):
+        """Blames lines first to last (0-based), and some around
+        them, ahead of the rest of a progressive blame."""
+        if not self.progressive or self.blamed.done:
+            return
+        margin = (last - first) // 2
+        first = max(first - margin, 0)
+        last = last + margin
+        if self.focusjob and self.focuslines[0] <= first and last <= self.focuslines[1]:
+            return
+        ranges = self.blamed.unblamed_ranges(first, last + 1)
+        if not ranges:
+            return
+        if self.focusjob:
+            # the view moved on; what it blamed so far is kept
+            self.scheduler.cancel(self.focusjob)
+            self.jobs.discard(self.focusjob)
+        self.focusjob = BlameJob(self.blamed, ranges, self.on_hunk, self.job_done)
+        self.focuslines = (first, last)
+        self.submit([self.focusjob])
+
+    def job_done(self, job):
+        self.jobs.discard(job)
+        if job is self.focusjob:
+            self.focusjob = None
+        if job.error:
+            self.blamed.error = job.error
+        if not self.blamed.error and [j for j in self.jobs if j is not self.focusjob]:
+            return
+        # the rest covered the file, a focus job left is not needed
+        self.cancel_blame()
+        self.on_done(self)
+
+    def cancel_blame(self):
+        for job in self.jobs:
+            self.scheduler.cancel(job)
+        self.jobs.clear()
+        self.focusjob = None
+        if self.refinejob:
+            self.scheduler.cancel(self.refinejob)
+            self.refinejob = None
+
+    def start_refine(self, on_done):
+        """Queues the second pass: a blame following moved and
+        copied lines, which credits refactored code to whoever
+        wrote it rather than whoever moved it. Its hunks replace
+        those of the first pass as they arrive. on_done(view)
+        is called when it is done. Returns False if the cache
+        had it."""
+        if self.refined:
+            return False
+        self.on_refined = on_done
+        self.refined_lines = 0
+        self.refinejob = BlameJob(self.blamed, None, self.on_refined_hunk, self.refine_done,
+                                  moves=True)
+        self.scheduler.submit(self.refinejob, self.job_priority(self.refinejob))
+        return True
+
+    def on_refined_hunk(self, blameline):
+        self.refined_lines += blameline.num_lines
+        self.on_hunk(blameline)
+
+    def refine_done(self, job):
+        self.refinejob = None
+        if not job.error:
+            self.refined = True
+            # ages span the commits the moved lines came from
+            self.blamed.finish()
+            with phases.phase('cache store', moves=True):
+                cache.store(cache.key_for(self.ident, moves=True), self.blamed.dump())
+        self.update_blame_lines()
+        self.on_refined(self)
+
+    def on_scroll(self, adjustment):
+        if self.progressive and self.jobs and not self.scrolltimeout:
+            self.scrolltimeout = gobject.timeout_add(self.SCROLLDELAY, self.on_scroll_timeout)
+
+    def on_scroll_timeout(self):
+        self.scrolltimeout = None
+        self.viewport = self.visible_lines()
+        self.focus(*self.viewport)
+        return False
+
+    def on_hunk(self, blameline):
+        self.redraw_hunk(blameline)
+        self.blamed_lines += blameline.num_lines
+        now = time.time()
+        if self.on_progress and now - self.last_progress > 0.1:
+            self.last_progress = now
+            self.on_progress(self)
+
+    def progress(self):
+        """Returns the fraction of the file blamed so far,
+        by the refinement once the first pass is done."""
+        if not self.blamed.num_lines:
+            return 1.0
+        if self.refinejob:
+            return min(1.0, float(self.refined_lines) / self.blamed.num_lines)
+        if self.blamed.done:
+            return 1.0
+        return min(1.0, float(self.blamed_lines) / self.blamed.num_lines)
+
+    def blame_finished(self):
+        if not self.blamed.done:
+            self.blamed.finish()
+        if not self.cachehit:
+            self.store_blame()
+
+        # ages were provisional until the oldest commit was seen
+        self.update_blame_lines()
+
+    def store_blame(self):
+        if self.refined:
+            # reblamed from a refined blame, see reload()
+            with phases.phase('cache store', moves=True):
+                cache.store(cache.key_for(self.ident, moves=True), self.blamed.dump())
+            return
+        ident = self.ident
+        if self.rev:
+            # only working tree blames are reblamed from
+            ident = None
+        with phases.phase('cache store'):
+            cache.store(self.cachekey, self.blamed.dump(), ident)
+
+    def author_stats(self):
+        """Returns (author, lines, commits) for each author,
+        most lines first."""
+        return sorted(self.blamed.author_stats(), key=lambda stat: (-stat[1], stat[0]))
+
+    def jump(self, author=False, forward=True):
+        """Moves the cursor to the next or previous block of
+        lines from the commit, or author, under the cursor."""
+        if not self.blamed or not self.blamed.done:
+            return
+        y = self.cursor_line()
+        if y >= self.blamed.num_lines:
+            return
+        if forward:
+            line = self.blamed.next_line(y, author)
+        else:
+            line = self.blamed.previous_line(y, author)
+        if line is not None:
+            self.sourcebuffer.place_cursor(self.sourcebuffer.get_iter_at_line(line))
+            self.sourceview.scroll_to_mark(self.sourcebuffer.get_insert(), 0.1)
+
+    def on_key_press(self, view, event):
+        # alt+up/down: same commit, with shift: same author
+        if not event.state & gtk.gdk.MOD1_MASK:
+            return False
+        if event.keyval not in (gtk.keysyms.Up, gtk.keysyms.Down):
+            return False
+        self.jump(bool(event.state & gtk.gdk.SHIFT_MASK), event.keyval == gtk.keysyms.Down)
+        return True
+
+    def toggle_author(self, author):
+        """Switches highlighting of the lines by author."""
+        if author in self.authors:
+            self.authors.discard(author)
+        else:
+            self.authors.add(author)
+        self.update_blame_lines()
+
+    def update_blame_lines(self):
+        self.sourceview.queue_draw()
+
+    def visible_lines(self):
+        """Returns the first and last line shown in the view."""
+        rect = self.sourceview.get_visible_rect()
+        first = self.sourceview.get_line_at_y(rect.y)[0].get_line()
+        last = self.sourceview.get_line_at_y(rect.y + rect.height)[0].get_line()
+        return first, last
+
+    def redraw_hunk(self, blameline):
+        """Queues a redraw of the lines of a hunk, if visible."""
+        self.redraw_lines(blameline.resultline - 1, blameline.num_lines)
+
+    def redraw_lines(self, start, count):
+        """Queues a redraw of count lines from start (0-based),
+        if visible."""
+        window = self.sourceview.get_window(gtk.TEXT_WINDOW_TEXT)
+        if not window:
+            return
+        first, last = self.visible_lines()
+        end = min(start + count - 1, last)
+        start = max(start, first)
+        if start > end:
+            return
+        top, _ = self.sourceview.get_line_yrange(self.sourcebuffer.get_iter_at_line(start))
+        y, height = self.sourceview.get_line_yrange(self.sourcebuffer.get_iter_at_line(end))
+        _, top = self.sourceview.buffer_to_window_coords(gtk.TEXT_WINDOW_TEXT, 0, top)
+        _, bottom = self.sourceview.buffer_to_window_coords(gtk.TEXT_WINDOW_TEXT, 0, y + height)
+        width, _ = window.get_size()
+        window.invalidate_rect(gtk.gdk.Rectangle(0, top, width, bottom - top), False)
+
+    def set_time_range(self, since, until):
+        """Dims the lines with an author time outside
+        [since, until]; None leaves that side open. Only
+        the hunks whose time lies between an old and a new
+        limit change color, so only they are redrawn."""
+        changed = []
+        if since != self.since:
+            changed.append(self.blamed.hunks_between(self.since or 0, since or 0))
+        if until != self.until:
+            # until is inclusive, so the half-open ranges shift by one
+            old = self.until is None and sys.maxint or self.until + 1
+            new = until is None and sys.maxint or until + 1
+            changed.append(self.blamed.hunks_between(old, new))
+        self.since = since
+        self.until = until
+        if sum(len(hunks) for hunks in changed) > self.MAXREDRAWS:
+            self.update_blame_lines()
+            return
+        for hunks in changed:
+            for h in hunks:
+                self.redraw_lines(self.blamed.hunk_start[h] - 1, self.blamed.hunk_len[h])
+
+    def on_expose(self, view, event):
+        window = view.get_window(gtk.TEXT_WINDOW_TEXT)
+        if event.window != window or not self.blamed:
+            return False
+        blamed = self.blamed
+        area = event.area
+        _, top = view.window_to_buffer_coords(gtk.TEXT_WINDOW_TEXT, 0, area.y)
+        it, _ = view.get_line_at_y(top)
+        cr = window.cairo_create()
+        cr.rectangle(area.x, area.y, area.width, area.height)
+        cr.clip()
+        bottom = top + area.height
+        while True:
+            y, height = view.get_line_yrange(it)
+            if y >= bottom:
+                break
+            color = blamed.line_color(it.get_line(), self.authors, self.since, self.until)
+            if color:
+                _, wy = view.buffer_to_window_coords(gtk.TEXT_WINDOW_TEXT, 0, y)
+                cr.set_source_rgb(*color)
+                cr.rectangle(area.x, wy, area.width, height)
+                cr.fill()
+            if not it.forward_line():
+                break
+        return False
+
+class MainWindow(gtk.Window):
+    PREFETCH = 6 # files blamed ahead after each finished blame
+    NEWEST = 3 # newest commits whose files are blamed ahead
+    GRAVATAR_TIMEOUT = 5000 # ms before telling that a gravatar is slow
+    WATCHDELAY = 300 # ms without changes before refreshing a view
+    POLLINTERVAL = 1000 # ms between checks where there is no inotify
+
+    def __init__(self):
+        gtk.Window.__init__(self)
+        self.connect('destroy', lambda w: gtk.main_quit())
+        self.connect('delete_event', lambda w, event: gtk.main_quit())
+        self.notebook = None
+        self.langmanager = None
+        self.stylemanager = None
+        self.liststore = None
+        self.image = None
+        self.gravaloader = None
+        self.gravatimeout = None
+        self.details = None
+        self.detailloaders = {}
+        self.tracker = CommitTracker()
+        self.sidelist = None
+        self.updating_authors = False
+        # commits shared by all open files
+        self.store = {}
+        self.scheduler = BlameScheduler()
+        self.prefetcher = None
+        # commits whose changed files are prefetched for a view
+        # once their details are loaded
+        self.prefetchwait = {}
+        # (fil, rev, line) locations for the back and forward buttons
+        self.back = []
+        self.forward = []
+        self.backbutton = None
+        self.forwardbutton = None
+        # prefetch of the parent blame of the commit under the
+        # cursor, and its (fil, rev)
+        self.parentjob = None
+        self.parentfetch = None
+        # (filename, chrome trace format) for --profile and --trace
+        self.profile = None
+        # for --watch: the files watched for each view, and the
+        # changed ones waiting for the changes to settle
+        self.watcher = None
+        self.watched = {}
+        self.changed = set()
+        self.watchtimeout = None
+
+    def setup(self):
+        sidesplit = gtk.HPaned()
+
+        box = gtk.VBox()
+        toolbar = gtk.Toolbar()
+        toolbar.set_style(gtk.TOOLBAR_ICONS)
+        button = gtk.ToolButton(gtk.STOCK_OPEN)
+        button.set_tooltip_text("Open a file")
+        button.connect('clicked', self.on_open_clicked)
+        toolbar.insert(button, -1)
+        button = gtk.ToolButton(gtk.STOCK_CLOSE)
+        button.set_tooltip_text("Close this file")
+        button.connect('clicked', self.on_close_clicked)
+        toolbar.insert(button, -1)
+        toolbar.insert(gtk.SeparatorToolItem(), -1)
+        for stock, tip, author, forward in ((gtk.STOCK_GO_UP, "Previous lines from this commit (Alt+Up)", False, False),
+                                            (gtk.STOCK_GO_DOWN, "Next lines from this commit (Alt+Down)", False, True),
+                                            (gtk.STOCK_GOTO_TOP, "Previous lines by this author (Alt+Shift+Up)", True, False),
+                                            (gtk.STOCK_GOTO_BOTTOM, "Next lines by this author (Alt+Shift+Down)", True, True)):
+            button = gtk.ToolButton(stock)
+            button.set_tooltip_text(tip)
+            button.connect('clicked', self.on_jump_clicked, author, forward)
+            toolbar.insert(button, -1)
+        toolbar.insert(gtk.SeparatorToolItem(), -1)
+        button = gtk.ToolButton(gtk.STOCK_UNDO)
+        button.set_tooltip_text("Blame the line before this commit (Alt+P)")
+        button.connect('clicked', lambda button: self.blame_parent())
+        toolbar.insert(button, -1)
+        self.backbutton = gtk.ToolButton(gtk.STOCK_GO_BACK)
+        self.backbutton.set_tooltip_text("Back (Alt+Left)")
+        self.backbutton.connect('clicked', lambda button: self.go_back())
+        toolbar.insert(self.backbutton, -1)
+        self.forwardbutton = gtk.ToolButton(gtk.STOCK_GO_FORWARD)
+        self.forwardbutton.set_tooltip_text("Forward (Alt+Right)")
+        self.forwardbutton.connect('clicked', lambda button: self.go_forward())
+        toolbar.insert(self.forwardbutton, -1)
+        self.update_history_buttons()
+        self.connect('key-press-event', self.on_key_press)
+        box.pack_start(toolbar, expand=False, fill=True, padding=0)
+
+        self.notebook = gtk.Notebook()
+        self.notebook.set_scrollable(True)
+        self.notebook.connect('switch-page', self.on_switch_page)
+        box.pack_start(self.notebook, expand=True, fill=True, padding=0)
+        self.liststore = gtk.ListStore(str, str)
+        treeview = gtk.TreeView(self.liststore)
+        treeview.set_headers_visible(False)
+        col = gtk.TreeViewColumn(None, gtk.CellRendererText(), text=0)
+        treeview.append_column(col)
+        col = gtk.TreeViewColumn(None, gtk.CellRendererText(), text=1)
+        treeview.append_column(col)
+        scroll = gtk.ScrolledWindow()
+        scroll.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scroll.add(treeview)
+        scroll.set_property('height-request', 120)
+        box2 = gtk.HBox()
+        box2.pack_start(scroll, expand=True, fill=True, padding=0)
+        gravaimg = gtk.Button()
+        self.image = gtk.Image()
+        self.image.set_size_request(80, 80)
+        self.image.set_from_stock(gtk.STOCK_MISSING_IMAGE, gtk.ICON_SIZE_LARGE_TOOLBAR)
+        self.image.show()
+        gravaimg.add(self.image)
+        self.gravaimg = gravaimg
+        self.gravaloader = GravatarLoader(lambda *result: gobject.idle_add(self.on_gravatar, *result))
+        self.gravaloader.start()
+        self.prefetcher = Prefetcher(lambda *result: gobject.idle_add(self.on_prefetched, *result),
+                                     self.store)
+        self.prefetcher.start()
+
+        box2.pack_end(gravaimg, expand=False, fill=True, padding=0)
+
+        # full commit details, loaded on demand
+        self.details = gtk.TextView()
+        self.details.set_editable(False)
+        self.details.set_wrap_mode(gtk.WRAP_WORD)
+        self.details.modify_font(pango.FontDescription('Monospace'))
+        scroll = gtk.ScrolledWindow()
+        scroll.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scroll.add(self.details)
+        scroll.set_property('height-request', 160)
+        expander = gtk.Expander("Details")
+        expander.add(scroll)
+        box.pack_end(expander, expand=False, fill=True, padding=0)
+        box.pack_end(box2, expand=False, fill=True, padding=4)
+        self.progressbar = gtk.ProgressBar()
+        self.progressbar.set_no_show_all(True)
+        box.pack_end(self.progressbar, expand=False, fill=True, padding=0)
+
+        sidesplit.pack1(box, resize=True)
+
+        self.sidelist = gtk.ListStore(str, str)
+        sidetree = gtk.TreeView(self.sidelist)
+        sidetree.connect("button-press-event", self.on_authors_clicked)
+        sidetree.get_selection().set_mode(gtk.SELECTION_MULTIPLE)
+        sidetree.get_selection().connect("changed", self.on_authors_changed)
+        #sidetree.set_headers_visible(False)
+        renderer = gtk.CellRendererText()
+        renderer.set_property("ellipsize", pango.ELLIPSIZE_END)
+        col = gtk.TreeViewColumn("Authors", renderer, text=0)
+        sidetree.append_column(col)
+        sidetree.set_tooltip_column(0)
+        sidetree.set_size_request(160, -1)
+        self.sidetree = sidetree
+
+        sidebox = gtk.VBox()
+        sidebox.pack_start(sidetree, expand=True, fill=True, padding=0)
+        # time filter: lines authored outside the range are dimmed
+        self.timescales = []
+        for name in ("From", "To"):
+            scale = gtk.HScale()
+            scale.set_draw_value(True)
+            scale.set_digits(0)
+            scale.set_update_policy(gtk.UPDATE_CONTINUOUS)
+            scale.connect('format-value', lambda scale, value: time.strftime('%Y-%m-%d', time.localtime(value)))
+            scale.connect('value-changed', self.on_time_changed)
+            scale.set_sensitive(False)
+            sidebox.pack_start(gtk.Label(name), expand=False, fill=True, padding=0)
+            sidebox.pack_start(scale, expand=False, fill=True, padding=0)
+            self.timescales.append(scale)
+
+        sidesplit.pack2(sidebox, resize=False)
+
+        sidesplit.set_position(-1)
+
+        self.add(sidesplit)
+
+    def current_view(self):
+        page = self.notebook.get_current_page()
+        if page < 0:
+            return None
+        return self.notebook.get_nth_page(page)
+
+    def views(self):
+        return [self.notebook.get_nth_page(i) for i in range(self.notebook.get_n_pages())]
+
+    def open_file(self, fil):
+        """Opens fil in a new tab, or switches to it if open."""
+        fil = os.path.abspath(fil)
+        for i, view in enumerate(self.views()):
+            if view.fil == fil and not view.rev:
+                self.notebook.set_current_page(i)
+                return view
+        view = self.new_view(fil)
+        if not view:
+            return None
+        page = self.notebook.append_page(view, self.tab_label(view))
+        self.notebook.set_current_page(page)
+        self.blame_view(view)
+        self.watch_view(view)
+        return view
+
+    def new_view(self, fil, rev=None, repo=None):
+        """Returns a loaded view of fil at rev, or None."""
+        if not self.langmanager:
+            self.langmanager = gtksourceview2.LanguageManager()
+            self.stylemanager = gtksourceview2.StyleSchemeManager()
+        view = FileView(fil, self.store, rev, repo)
+        view.on_progress = self.show_progress
+        view.setup(self.langmanager, self.stylemanager)
+        try:
+            view.load()
+        except IOError:
+            sys.stderr.write("Unable to open %s!\n"%(view.title()))
+            return None
+        view.sourcebuffer.connect_after('mark-set', self.on_mark_set, view)
+        view.show_all()
+        return view
+
+    def tab_label(self, view):
+        label = gtk.Label(view.title())
+        if view.rev:
+            label.set_tooltip_text("%s at %s" % (view.fil, view.rev))
+        else:
+            label.set_tooltip_text(view.fil)
+        return label
+
+    def blame_view(self, view):
+        if not view.start_blame(self.scheduler, 0, self.view_blamed):
+            self.view_blamed(view)
+
+    def show_location(self, location):
+        """Replaces the current tab by (fil, rev, line).
+        Returns False if the file cannot be read at rev."""
+        fil, rev, line = location
+        old = self.current_view()
+        view = self.new_view(fil, rev, old.repo())
+        if not view:
+            return False
+        page = self.notebook.page_num(old)
+        self.close_view(old)
+        self.notebook.insert_page(view, self.tab_label(view), page)
+        self.notebook.set_current_page(page)
+        view.goto_line(line)
+        view.sourceview.grab_focus()
+        self.blame_view(view)
+        self.watch_view(view)
+        return True
+
+    def location(self, view):
+        return view.fil, view.rev, view.cursor_line()
+
+    def blame_parent(self):
+        """Shows the line under the cursor in the parent of
+        the commit blamed for it."""
+        view = self.current_view()
+        parent = view and view.parent_location()
+        if not parent:
+            return
+        here = self.location(view)
+        if self.show_location(parent):
+            self.back.append(here)
+            del self.forward[:]
+            self.update_history_buttons()
+
+    def go_back(self):
+        view = self.current_view()
+        if view and self.back:
+            here = self.location(view)
+            if self.show_location(self.back[-1]):
+                self.back.pop()
+                self.forward.append(here)
+                self.update_history_buttons()
+
+    def go_forward(self):
+        view = self.current_view()
+        if view and self.forward:
+            here = self.location(view)
+            if self.show_location(self.forward[-1]):
+                self.forward.pop()
+                self.back.append(here)
+                self.update_history_buttons()
+
+    def update_history_buttons(self):
+        self.backbutton.set_sensitive(bool(self.back))
+        self.forwardbutton.set_sensitive(bool(self.forward))
+
+    def on_key_press(self, widget, event):
+        # alt+left/right: history, alt+p: blame the parent
+        if not event.state & gtk.gdk.MOD1_MASK:
+            return False
+        if event.keyval == gtk.keysyms.Left:
+            self.go_back()
+        elif event.keyval == gtk.keysyms.Right:
+            self.go_forward()
+        elif event.keyval in (gtk.keysyms.p, gtk.keysyms.P):
+            self.blame_parent()
+        else:
+            return False
+        return True
+
+    def prefetch_parent(self, view, commit):
+        """Blames the file before commit into the cache, so
+        that blame_parent on it is instant. Only the last
+        commit asked for is kept waiting."""
+        parent = view.blamed.parent_of(commit)
+        if not parent:
+            return
+        rev, path = parent
+        fil = os.path.join(view.repo(), path)
+        if (fil, rev) == self.parentfetch:
+            return
+        if self.parentjob and not self.parentjob.done:
+            self.scheduler.cancel(self.parentjob)
+            self.prefetcher.forget(*self.parentfetch)
+        self.parentjob = None
+        self.parentfetch = (fil, rev)
+        # the cache lookup and reading the blob run in the background
+        self.prefetcher.request_rev(fil, rev, view.repo())
+
+    def close_view(self, view):
+        view.close()
+        self.unwatch_view(view)
+        self.notebook.remove_page(self.notebook.page_num(view))
+
+    def on_open_clicked(self, button):
+        dialog = gtk.FileChooserDialog("Open", self, gtk.FILE_CHOOSER_ACTION_OPEN,
+                                       (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+                                        gtk.STOCK_OPEN, gtk.RESPONSE_OK))
+        dialog.set_select_multiple(True)
+        view = self.current_view()
+        if view:
+            dialog.set_current_folder(os.path.dirname(view.fil))
+        if dialog.run() == gtk.RESPONSE_OK:
+            for fil in dialog.get_filenames():
+                self.open_file(fil)
+        dialog.destroy()
+
+    def on_jump_clicked(self, button, author, forward):
+        view = self.current_view()
+        if view:
+            view.jump(author, forward)
+            view.sourceview.grab_focus()
+
+    def on_close_clicked(self, button):
+        view = self.current_view()
+        if view:
+            self.close_view(view)
+
+    def on_switch_page(self, notebook, page, page_num):
+        view = notebook.get_nth_page(page_num)
+        # blames of the tabs left behind give way to this one
+        for other in self.views():
+            if other is not view:
+                other.set_priority(1)
+        view.set_priority(0)
+        self.tracker.current_commit = None
+        self.liststore.clear()
+        self.details.get_buffer().set_text("")
+        self.update_authors(view)
+        self.show_progress(view)
+
+    def start_watching(self):
+        """Refreshes the views when their files are saved, or
+        when a commit or checkout changes HEAD."""
+        self.watcher = watch.watcher()
+        if self.watcher.fileno() is not None:
+            gobject.io_add_watch(self.watcher.fileno(), gobject.IO_IN, self.on_watch)
+        else:
+            gobject.timeout_add(self.POLLINTERVAL, self.on_watch)
+        for view in self.views():
+            self.watch_view(view)
+
+    def watch_view(self, view):
+        if not self.watcher or view.rev:
+            return
+        self.unwatch_view(view)
+        paths = [view.fil] + watch.head_paths(view.repo())
+        for path in paths:
+            self.watcher.add(path)
+        self.watched[view] = set(os.path.abspath(path) for path in paths)
+
+    def unwatch_view(self, view):
+        for path in self.watched.pop(view, ()):
+            self.watcher.remove(path)
+
+    def on_watch(self, *args):
+        changed = self.watcher.changed()
+        if changed:
+            # refresh once an editor or git is done writing
+            self.changed.update(changed)
+            if self.watchtimeout:
+                gobject.source_remove(self.watchtimeout)
+            self.watchtimeout = gobject.timeout_add(self.WATCHDELAY, self.on_watch_timeout)
+        return True
+
+    def on_watch_timeout(self):
+        self.watchtimeout = None
+        changed = self.changed
+        self.changed = set()
+        for view in self.views():
+            if self.watched.get(view, set()) & changed:
+                self.refresh_view(view)
+        return False
+
+    def refresh_view(self, view):
+        """Reblames view if its file or HEAD changed."""
+        ident = cache.identify(view.fil)
+        if not ident or ident == view.ident:
+            return
+        try:
+            blaming = view.reload(self.view_blamed)
+        except IOError:
+            # removed, or in the middle of being replaced
+            return
+        if not blaming:
+            self.view_blamed(view)
+        # a checkout may have moved HEAD to another branch
+        self.watch_view(view)
+        if view is self.current_view():
+            self.show_progress(view)
+
+    def show_progress(self, view=None, text=None):
+        """Shows how far the blame of view is, or pulses
+        with text while there is no view yet."""
+        if text:
+            self.progressbar.set_text(text)
+            self.progressbar.pulse()
+            self.progressbar.show()
+            return
+        view = view or self.current_view()
+        if view is not self.current_view():
+            return
+        if not view or view.blamed.done and not view.refinejob:
+            self.progressbar.hide()
+            return
+        if view.refinejob:
+            # the first pass is shown, the second replaces it bit by bit
+            self.progressbar.set_text("Following moved lines in %s..." % os.path.basename(view.fil))
+        else:
+            self.progressbar.set_text("Blaming %s..." % os.path.basename(view.fil))
+        self.progressbar.set_fraction(view.progress())
+        self.progressbar.show()
+
+    def open_files(self, files):
+        """Opens files one per main loop iteration, so that
+        the window stays responsive. Exits if none opens."""
+        if not files:
+            if not self.notebook.get_n_pages():
+                sys.exit(1)
+            return False
+        fil = files.pop(0)
+        self.show_progress(text="Opening %s..." % os.path.basename(fil))
+        with phases.phase('open', file=fil):
+            view = self.open_file(fil)
+        if view:
+            self.show_progress(view)
+        return True
+
+    def view_blamed(self, view):
+        if view.blamed.error or not view.blamed.commits:
+            print "no lines to blame, sure this file is in a git repository?"
+            self.close_view(view)
+            if not self.notebook.get_n_pages():
+                sys.exit(1)
+            return
+        view.blame_finished()
+        view.start_refine(self.view_refined)
+        if view is self.current_view():
+            with phases.phase('authors list'):
+                self.update_authors(view)
+        self.write_profile()
+        self.show_progress(view)
+        self.prefetch_avatars(view)
+        if not view.rev:
+            self.prefetch(view)
+
+    def view_refined(self, view):
+        if view is self.current_view():
+            self.update_authors(view)
+        self.show_progress(view)
+        self.prefetch_avatars(view)
+
+    def prefetch_avatars(self, view):
+        # have every avatar ready before its line is clicked
+        self.gravaloader.prefetch(c.author_mail[1:-1] for c in view.blamed.commits
+                                  if c.sha1 != '0'*40)
+
+    def write_profile(self):
+        if self.profile:
+            filename, trace = self.profile
+            phases.recorder.write(filename, trace)
+
+    def prefetch(self, view):
+        """Blames files likely to be opened next into the
+        cache: files changed by the newest commits of view,
+        and the files next to it."""
+        candidates = []
+        loader = self.detail_loader(view)
+        newest = sorted(view.blamed.commits, key=lambda c: -(c.author_time or 0))[:self.NEWEST]
+        for commit in newest:
+            details = loader.get(commit.sha1)
+            if details:
+                candidates.extend(self.changed_files(view, details))
+            else:
+                self.prefetchwait[commit.sha1] = view
+                loader.request(commit.sha1, 2)
+        # the cache is asked about them in the background
+        self.prefetcher.request(candidates, self.PREFETCH, view.fil,
+                                [v.fil for v in self.views()])
+
+    def changed_files(self, view, details):
+        return [os.path.join(view.repo(), path) for status, path in details.files
+                if status != 'D']
+
+    def prefetch_commit(self, details):
+        """Blames the files changed by a commit prefetch()
+        waited for the details of."""
+        view = self.prefetchwait.pop(details.sha1, None)
+        if view is None or view not in self.views():
+            return
+        self.prefetcher.request(self.changed_files(view, details), self.PREFETCH // self.NEWEST,
+                                None, [v.fil for v in self.views()])
+
+    def on_prefetched(self, blamed, key, ident):
+        if blamed.rev and (blamed.fil, blamed.rev) != self.parentfetch:
+            # the cursor moved on to another commit meanwhile
+            self.prefetcher.forget(blamed.fil, blamed.rev)
+            return False
+        def done(job):
+            if not job.error and job.blamed.commits:
+                cache.store(key, job.blamed.dump(), ident)
+        job = BlameJob(blamed, on_done=done)
+        if blamed.rev:
+            self.parentjob = job
+        self.scheduler.submit(job, 2)
+        return False
+
+    def update_time_filter(self, view):
+        """Sets the range of the time sliders to the commit
+        times of view, and their positions to its filter."""
+        self.updating_authors = True
+        blamed = view.blamed
+        ready = bool(blamed and blamed.done and blamed.oldest is not None
+                     and blamed.oldest < blamed.newest)
+        since, until = self.timescales
+        for scale, value, default in ((since, view.since, ready and blamed.oldest),
+                                      (until, view.until, ready and blamed.newest)):
+            scale.set_sensitive(ready)
+            if ready:
+                scale.set_range(blamed.oldest, blamed.newest)
+                scale.set_increments(86400, 30 * 86400)
+                scale.set_value(value is None and default or value)
+        self.updating_authors = False
+
+    def on_time_changed(self, scale):
+        view = self.current_view()
+        if self.updating_authors or not view or not view.blamed.done:
+            return
+        since = int(self.timescales[0].get_value())
+        until = int(self.timescales[1].get_value())
+        # a slider at its end leaves that side open
+        if since <= view.blamed.oldest:
+            since = None
+        if until >= view.blamed.newest:
+            until = None
+        view.set_time_range(since, until)
+
+    def update_authors(self, view):
+        """Fills the Authors list from view."""
+        self.update_time_filter(view)
+        self.updating_authors = True
+        self.sidelist.clear()
+        if view.blamed and view.blamed.done:
+            selection = self.sidetree.get_selection()
+            for a, lines, commits in view.author_stats():
+                it = self.sidelist.append(["%s (%d lines, %d commits)" % (a, lines, commits), a])
+                if a in view.authors:
+                    selection.select_iter(it)
+        self.updating_authors = False
+
+    def on_authors_clicked(self, tv, event):
+        try:
+            path, column, pos_x, pos_y = tv.get_path_at_pos(int(event.x), int(event.y))
+        except:
+            return False
+
+        # clicking a highlighted author turns it off again
+        selection = tv.get_selection()
+        if selection.path_is_selected(path):
+            selection.unselect_path(path)
+            return True
+        return False
+
+    def on_authors_changed(self, selection):
+        view = self.current_view()
+        if self.updating_authors or not view:
+            return
+        store, paths = selection.get_selected_rows()
+        authors = set(store.get_value(store.get_iter(path), 1) for path in paths)
+        for author in authors.symmetric_difference(view.authors):
+            view.toggle_author(author)
+
+    def detail_loader(self, view):
+        """Returns the commit detail loader for the repository of view."""
+        repo = view.repo()
+        loader = self.detailloaders.get(repo)
+        if not loader:
+            loader = catfile.DetailLoader(repo, lambda details: gobject.idle_add(self.on_details, details))
+            loader.start()
+            self.detailloaders[repo] = loader
+        return loader
+
+    def current_mail(self):
+        commit = self.tracker.current_commit
+        if commit:
+            return commit.author_mail[1:-1]
+        return None
+
+    def set_gravatar(self, pixbuf=None, stock=gtk.STOCK_MISSING_IMAGE, tooltip=None):
+        if self.gravatimeout:
+            gobject.source_remove(self.gravatimeout)
+            self.gravatimeout = None
+        if pixbuf:
+            self.image.set_from_pixbuf(pixbuf)
+        else:
+            self.image.set_from_stock(stock, gtk.ICON_SIZE_LARGE_TOOLBAR)
+        self.gravaimg.set_tooltip_text(tooltip)
+
+    def on_gravatar(self, email, pixbuf, error):
+        """Called in the main loop when a gravatar fetch is done."""
+        if email == self.current_mail():
+            if pixbuf:
+                self.set_gravatar(pixbuf)
+            else:
+                self.set_gravatar(stock=gtk.STOCK_DIALOG_ERROR,
+                                  tooltip="No gravatar for %s: %s" % (email, error))
+        return False
+
+    def on_gravatar_timeout(self, email):
+        self.gravatimeout = None
+        if email == self.current_mail():
+            self.gravaimg.set_tooltip_text("Still waiting for the gravatar of %s" % (email))
+        return False
+
+    def on_details(self, details):
+        self.prefetch_commit(details)
+        commit = self.tracker.current_commit
+        if commit and commit.sha1 == details.sha1:
+            self.show_details(commit)
+        return False
+
+    def show_details(self, commit):
+        buf = self.details.get_buffer()
+        details = self.detail_loader(self.current_view()).get(commit.sha1)
+        if not details:
+            if commit.sha1 == '0'*40:
+                buf.set_text("Not committed yet.")
+            else:
+                buf.set_text("Loading...")
+            return
+        text = ["Author:    %s" % details.author,
+                "Committer: %s" % details.committer,
+                "Parents:   %s" % ", ".join(details.parents),
+                "",
+                details.message.rstrip(),
+                ""]
+        if details.files:
+            text.append("Changed files:")
+            text.extend("  %s %s" % change for change in details.files)
+        buf.set_text("\n".join(text))
+
+    def on_mark_set(self, buffer, param, param2, view):
+        if param2 is not buffer.get_insert() or view is not self.current_view():
+            return
+        tracker = self.tracker
+        iter = buffer.get_iter_at_mark(param2)
+        commit = None
+        if iter.get_line() < view.blamed.num_lines:
+            commit = view.blamed.commit_at(iter.get_line())
+        if not commit:
+            tracker.current_commit = None
+            self.set_gravatar()
+            self.liststore.clear()
+            return
+
+        if tracker.current_commit is commit:
+            return
+
+        self.liststore.clear()
+        self.liststore.append(['Author', commit.author])
+        self.liststore.append(['Email', commit.author_mail])
+        self.liststore.append(['Time', time.ctime(commit.author_time)])
+        self.liststore.append(['Summary', commit.summary])
+
+        if commit.sha1 != '0'*40:
+            self.liststore.append(['SHA1', commit.sha1])
+        self.show_details(commit)
+
+        # details of the commits nearby are likely wanted next
+        line = iter.get_line()
+        loader = self.detail_loader(view)
+        loader.request(commit.sha1, 0)
+        for h in view.blamed.neighbour_hunks(line):
+            loader.request(view.blamed.commits[view.blamed.hunk_commit[h]].sha1, 1)
+        self.prefetch_parent(view, commit)
+
+        tracker.current_commit = commit
+
+        #set image to
+        mail = commit.author_mail[1:-1]
+        if mail == "not.committed.yet":
+            self.set_gravatar(stock=gtk.STOCK_DIALOG_WARNING)
+        else:
+            grava = self.gravaloader.get(mail)
+            if grava:
+                self.set_gravatar(grava)
+            else:
+                # on_gravatar shows it when it arrives
+                self.set_gravatar()
+                self.gravaloader.request(mail, avatars.FOCUS)
+                self.gravatimeout = gobject.timeout_add(self.GRAVATAR_TIMEOUT, self.on_gravatar_timeout, mail)
+
+class HeatmapWindow(gtk.Window):
+    """Tree of the files and directories of a repository,
+    with their age statistics filled in as files are blamed."""
+    def __init__(self, root, older_than):
+        gtk.Window.__init__(self)
+        self.connect('destroy', lambda w: gtk.main_quit())
+        self.root = root
+        self.older_than = older_than
+        self.tree = heatmap.Tree()
+        self.rows = {}
+        self.scanned = 0
+        self.store = None
+        self.scanner = None
+
+    def setup(self):
+        # name, lines, mean age, top author, old fraction, color, path
+        self.store = gtk.TreeStore(str, int, float, str, float, str, str)
+        self.store.set_sort_column_id(0, gtk.SORT_ASCENDING)
+        view = gtk.TreeView(self.store)
+        view.connect('row-activated', self.on_row_activated)
+        columns = [("Name", 0, None),
+                   ("Lines", 1, None),
+                   ("Mean age (days)", 2, "%.0f"),
+                   ("Top author", 3, None),
+                   ("Older than %d days" % self.older_than, 4, "%.0f%%")]
+        for title, index, fmt in columns:
+            renderer = gtk.CellRendererText()
+            col = gtk.TreeViewColumn(title, renderer, text=index, background=5)
+            if fmt:
+                col.set_cell_data_func(renderer, self.format_cell, (index, fmt))
+            col.set_sort_column_id(index)
+            col.set_resizable(True)
+            view.append_column(col)
+        scroll = gtk.ScrolledWindow()
+        scroll.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scroll.add(view)
+        self.add(scroll)
+
+    def format_cell(self, col, renderer, model, it, data):
+        index, fmt = data
+        value = model.get_value(it, index)
+        if index == 4:
+            value *= 100
+        renderer.set_property('text', fmt % value)
+
+    def scan(self):
+        def done(path, result):
+            gobject.idle_add(self.add_result, path, result)
+        self.scanner = heatmap.Scanner(self.root, done)
+        self.scanner.start()
+
+    def add_result(self, path, result):
+        self.scanned += 1
+        self.set_title("git-age: %s (%d files)" % (self.root, self.scanned))
+        if 'error' in result:
+            return False
+        stats = heatmap.file_stats(result, self.older_than)
+        for changed in reversed(self.tree.add(path, stats)):
+            self.update_row(changed)
+        return False
+
+    def update_row(self, path):
+        stats = self.tree.nodes[path]
+        it = self.rows.get(path)
+        if not it:
+            if path:
+                parent = self.rows[path.rpartition('/')[0]]
+                name = path.rpartition('/')[2]
+            else:
+                parent = None
+                name = self.root
+            it = self.store.append(parent)
+            self.store.set(it, 0, name, 6, path)
+            self.rows[path] = it
+        author, share = stats.top_author()
+        self.store.set(it,
+                       1, stats.lines,
+                       2, stats.mean_age(),
+                       3, "%s (%.0f%%)" % (author, share * 100),
+                       4, stats.old_fraction(),
+                       5, color_for_age(int(100 * stats.old_fraction())))
+
+    def on_row_activated(self, view, treepath, col):
+        path = self.store.get_value(self.store.get_iter(treepath), 6)
+        fil = os.path.join(self.root, path)
+        if path and os.path.isfile(fil):
+            subprocess.Popen([sys.executable, os.path.abspath(sys.argv[0]), fil])
+
+def set_icon(win):
+    if platform.system() == 'Windows':
+        name = "peachy.ico"
+    else:
+        name = "peachy.svg"
+    iconfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", name)
+    try:
+        if os.path.exists(iconfile):
+            win.set_icon_from_file(iconfile)
+        else:
+            # installed as a zipped egg
+            loader = gtk.gdk.PixbufLoader()
+            loader.write(pkgutil.get_data(__name__, "data/" + name))
+            loader.close()
+            win.set_icon(loader.get_pixbuf())
+    except Exception, e:
+        print e
+
+def main(args):
+    if isinstance(args, basestring):
+        args = [args]
+    parser = OptionParser(usage="%prog [options] <file>...")
+    parser.add_option("--profile", metavar="FILE",
+                      help="write the time and memory used by each phase of opening the files to FILE as JSON")
+    parser.add_option("--trace", metavar="FILE",
+                      help="like --profile, in Chrome trace format and with parse counters for every hunk")
+    parser.add_option("-w", "--watch", action="store_true", default=False,
+                      help="refresh the blame when a file is saved, or on a commit or checkout")
+    options, files = parser.parse_args(args)
+    if not files:
+        parser.error("no file given")
+
+    win = MainWindow()
+    if options.trace:
+        phases.recorder.enable(hunks=True)
+        win.profile = (options.trace, True)
+    elif options.profile:
+        phases.recorder.enable()
+        win.profile = (options.profile, False)
+
+    with phases.phase('setup window'):
+        gtk.gdk.threads_init()
+        set_icon(win)
+        win.setup()
+    if options.watch:
+        win.start_watching()
+
+    win.set_title("git-age")
+    win.resize(600,500)
+    with phases.phase('show window'):
+        win.show_all()
+    # the window maps first, the files are read and blamed after
+    gobject.idle_add(win.open_files, list(files))
+    # until the first lines are on screen
+    span = phases.phase('first paint')
+    def on_first_expose(widget, event):
+        span.end()
+        widget.disconnect(handler)
+        return False
+    handler = win.connect_after('expose-event', on_first_expose)
+
+    gtk.gdk.threads_enter()
+    try:
+        gtk.main()
+    finally:
+        win.write_profile()
+
+def tree_main(args):
+    parser = OptionParser(usage="%prog --tree [options] [directory]")
+    parser.add_option("-n", "--older-than", type="int", default=365, metavar="DAYS",
+                      help="count lines older than DAYS as old (default: 365)")
+    options, paths = parser.parse_args(args)
+    root = paths and paths[0] or '.'
+
+    gtk.gdk.threads_init()
+    win = HeatmapWindow(root, options.older_than)
+    set_icon(win)
+    win.setup()
+    win.set_title("git-age: %s" % root)
+    win.resize(700,500)
+    win.show_all()
+    win.scan()
+
+    gtk.gdk.threads_enter()
+    gtk.main()
@@ -0,0 +1,109 @@
+# heatmap.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# repository-wide age statistics, rolled up
+# per directory as files are blamed.
+#
+import os, time, threading
+import multiprocessing
+import report
+
+_DAY = 24 * 3600
+
+class Stats(object):
+    """Line-weighted age statistics of a file or directory."""
+    __slots__ = ('lines', 'age_days', 'old_lines', 'authors', 'files')
+
+    def __init__(self):
+        self.lines = 0
+        self.age_days = 0.0 # sum over all lines
+        self.old_lines = 0
+        self.authors = {}
+        self.files = 0
+
+    def add(self, other):
+        self.lines += other.lines
+        self.age_days += other.age_days
+        self.old_lines += other.old_lines
+        self.files += other.files
+        for author, count in other.authors.iteritems():
+            self.authors[author] = self.authors.get(author, 0) + count
+
+    def mean_age(self):
+        """Mean age of the lines in days."""
+        if not self.lines:
+            return 0.0
+        return self.age_days / self.lines
+
+    def old_fraction(self):
+        if not self.lines:
+            return 0.0
+        return float(self.old_lines) / self.lines
+
+    def top_author(self):
+        """Returns (author, share of lines) of the main author."""
+        if not self.authors:
+            return None, 0.0
+        author, count = max(self.authors.iteritems(), key=lambda a: a[1])
+        return author, float(count) / self.lines
+
+def file_stats(result, older_than, now=None):
+    """Stats of a report.blame_file() result, counting lines
+    older than older_than days as old."""
+    now = now or time.time()
+    stats = Stats()
+    stats.files = 1
+    commits = result['commits']
+    for c, start, count in result['hunks']:
+        sha1, author, mail, when, age = commits[c]
+        days = max(now - (when or now), 0) / _DAY
+        stats.lines += count
+        stats.age_days += days * count
+        if days > older_than:
+            stats.old_lines += count
+        stats.authors[author] = stats.authors.get(author, 0) + count
+    return stats
+
+class Tree(object):
+    """Stats for every file and directory under a root,
+    with directories rolled up as files are added."""
+    def __init__(self):
+        self.nodes = {'': Stats()}
+
+    def add(self, path, stats):
+        """Adds the stats of the file at path (relative to the
+        root, '/'-separated). Returns the changed paths, the file
+        first and the root last."""
+        self.nodes[path] = stats
+        changed = [path]
+        parent = path
+        while parent:
+            parent = parent.rpartition('/')[0]
+            self.nodes.setdefault(parent, Stats()).add(stats)
+            changed.append(parent)
+        return changed
+
+class Scanner(threading.Thread):
+    """Blames files in a process pool from a background
+    thread, calling callback(path, result) as each is done."""
+    def __init__(self, root, callback, jobs=None):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.root = root
+        self.callback = callback
+        self.jobs = jobs or multiprocessing.cpu_count()
+
+    def run(self):
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            for result in pool.imap_unordered(report.blame_file, report.expand([self.root]), 4):
+                path = os.path.relpath(result['file'], self.root).replace(os.sep, '/')
+                self.callback(path, result)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
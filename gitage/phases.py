@@ -0,0 +1,165 @@
+# phases.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# records the wall time, CPU time and memory of the phases
+# of opening a file, for --profile and --trace.
+#
+import os, time, threading
+import json
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def _cpu():
+    t = os.times()
+    return t[0] + t[1]
+
+def _rss_kb():
+    """Returns the current resident size in kilobytes,
+    or the peak size where that is all there is."""
+    try:
+        f = open('/proc/self/statm')
+        try:
+            pages = int(f.read().split()[1])
+        finally:
+            f.close()
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    if resource:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return 0
+
+class _Span(object):
+    __slots__ = ('recorder', 'name', 'args', 'start', 'cpu', 'rss')
+
+    def __init__(self, recorder, name, args):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+        self.start = time.time()
+        self.cpu = _cpu()
+        self.rss = _rss_kb()
+
+    def end(self):
+        self.recorder._add(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.end()
+        return False
+
+class _NoSpan(object):
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_nospan = _NoSpan()
+
+class Recorder(object):
+    """Collects phases and counters. Does nothing
+    until enabled, so it can be left in place."""
+    def __init__(self):
+        self.enabled = False
+        self.hunks = False
+        self.origin = time.time()
+        self.phases = []
+        self.counters = {}
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def enable(self, hunks=False):
+        """Starts recording; with hunks, also a sample
+        of the parse counters at every hunk."""
+        self.enabled = True
+        self.hunks = hunks
+
+    def phase(self, name, **args):
+        """Returns a span to use with 'with', or to end()
+        later for phases that run in the main loop."""
+        if not self.enabled:
+            return _nospan
+        return _Span(self, name, args)
+
+    def _add(self, span):
+        now = time.time()
+        rss = _rss_kb()
+        self._lock.acquire()
+        try:
+            self.phases.append({'name': span.name,
+                                'start': span.start - self.origin,
+                                'wall': now - span.start,
+                                'cpu': _cpu() - span.cpu,
+                                'rss_kb': rss,
+                                'rss_delta_kb': rss - span.rss,
+                                'thread': threading.currentThread().getName(),
+                                'args': span.args})
+        finally:
+            self._lock.release()
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def hunk(self, lines):
+        """Counts a parsed hunk of lines lines."""
+        if not self.enabled:
+            return
+        self.count('hunks')
+        self.count('hunk_lines', lines)
+        if self.hunks:
+            self.samples.append((time.time() - self.origin, self.counters['hunks'],
+                                 self.counters['hunk_lines']))
+
+    def report(self):
+        """Returns the recording as a JSON-able dict."""
+        return {'phases': sorted(self.phases, key=lambda p: p['start']),
+                'counters': self.counters}
+
+    def chrome_trace(self):
+        """Returns the recording in the Chrome trace event
+        format, for chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for p in self.phases:
+            tid = threads.setdefault(p['thread'], len(threads) + 1)
+            args = dict(p['args'], cpu_ms=p['cpu'] * 1000, rss_kb=p['rss_kb'],
+                        rss_delta_kb=p['rss_delta_kb'])
+            events.append({'name': p['name'], 'ph': 'X', 'pid': pid, 'tid': tid,
+                           'ts': int(p['start'] * 1e6), 'dur': int(p['wall'] * 1e6),
+                           'args': args})
+        for name, tid in threads.iteritems():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                           'args': {'name': name}})
+        for t, hunks, lines in self.samples:
+            events.append({'name': 'parsed', 'ph': 'C', 'pid': pid, 'tid': 0,
+                           'ts': int(t * 1e6), 'args': {'hunks': hunks, 'lines': lines}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'counters': self.counters}}
+
+    def write(self, filename, trace=False):
+        """Writes the report, or the Chrome trace, to filename."""
+        if trace:
+            data = self.chrome_trace()
+        else:
+            data = self.report()
+        f = open(filename, 'w')
+        try:
+            json.dump(data, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+recorder = Recorder()
+phase = recorder.phase
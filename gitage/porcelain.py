@@ -0,0 +1,119 @@
+# porcelain.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# streaming parser for the output of git blame
+# --incremental and --porcelain.
+#
+import re
+
+_CHUNKSIZE = 1 << 16
+# sha1 sourceline resultline [num_lines]
+_HEADER = re.compile(r'^[0-9a-f]{40}( \d+){2,3}$')
+
+def _text(value):
+    return value
+
+def _time(value):
+    return int(value)
+
+def _boundary(value):
+    return True
+
+# git blame metadata key -> (attribute name, conversion)
+KEYS = {
+    'author': ('author', intern),
+    'author-mail': ('author_mail', intern),
+    'author-time': ('author_time', _time),
+    'author-tz': ('author_tz', intern),
+    'committer': ('committer', intern),
+    'committer-mail': ('committer_mail', intern),
+    'committer-time': ('committer_time', _time),
+    'committer-tz': ('committer_tz', intern),
+    'summary': ('summary', _text),
+    'boundary': ('boundary', _boundary),
+    'previous': ('previous', _text),
+    'filename': ('filename', intern),
+}
+
+class HunkParser(object):
+    """Parses blame output fed to it in chunks of any size.
+    A hunk is a tuple (sha1, sourceline, resultline, num_lines,
+    attrs), where attrs maps the attribute names in KEYS to the
+    metadata git gave with the hunk (only with the first hunk
+    of each commit)."""
+    def __init__(self):
+        self._pending = ''
+        self._hunk = None
+        self._attrs = None
+
+    def feed(self, data):
+        """Parses data. Returns the list of hunks completed by it."""
+        if self._pending:
+            data = self._pending + data
+        lines = data.split('\n')
+        self._pending = lines.pop()
+        return self._parse(lines)
+
+    def close(self):
+        """Parses what is left after the last newline.
+        Returns the hunks completed by it."""
+        pending = self._pending
+        self._pending = ''
+        if pending:
+            return self._parse([pending])
+        return []
+
+    def _parse(self, lines):
+        hunks = []
+        keys = KEYS
+        hunk = self._hunk
+        attrs = self._attrs
+        for line in lines:
+            if not line:
+                continue
+            if line[0] == '\t':
+                # a --porcelain content line ends the hunk, if
+                # no filename did, as for commits seen before
+                if hunk is not None:
+                    hunks.append(hunk + (attrs,))
+                    hunk = None
+                continue
+            if hunk is None:
+                # between hunks, only a header is expected; within
+                # one, a summary may look like one
+                if _HEADER.match(line):
+                    fields = line.split(' ')
+                    if len(fields) == 4:
+                        hunk = (fields[0], int(fields[1]), int(fields[2]), int(fields[3]))
+                        attrs = {}
+                    # else --porcelain repeating the header for each line
+                continue
+            key, _, value = line.partition(' ')
+            if key == 'filename':
+                # filename is always the last line of an --incremental hunk
+                attrs['filename'] = intern(value)
+                hunks.append(hunk + (attrs,))
+                hunk = None
+                continue
+            entry = keys.get(key)
+            if entry:
+                attrs[entry[0]] = entry[1](value)
+        self._hunk = hunk
+        self._attrs = attrs
+        return hunks
+
+def parse(stream, chunksize=_CHUNKSIZE):
+    """Yields the hunks of the blame output read from the
+    file object stream, as HunkParser describes them."""
+    parser = HunkParser()
+    read = stream.read
+    while True:
+        data = read(chunksize)
+        if not data:
+            break
+        for hunk in parser.feed(data):
+            yield hunk
+    for hunk in parser.close():
+        yield hunk
@@ -0,0 +1,123 @@
+# prefetch.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# picks the files to blame ahead in a background thread,
+# so that the git processes asking the cache about them
+# never hold up the main loop.
+#
+import os, threading
+from collections import deque
+import cache
+import gitcmd
+from blame import BlamedFile
+
+_CHECKS = 4 # candidates checked per file to blame ahead
+
+def siblings(fil):
+    """Returns the files tracked by git next to fil, nearest
+    first, fil itself left out."""
+    directory = os.path.dirname(fil)
+    out = gitcmd.output("ls-files", "-z", "--", ".", cwd=directory) or ''
+    names = sorted(os.path.join(directory, name) for name in out.split('\0')
+                   if name and '/' not in name)
+    if fil not in names:
+        return []
+    i = names.index(fil)
+    near = []
+    for k in range(1, len(names)):
+        near.extend(names[i+k:i+k+1] + names[max(i-k, 0):max(i-k+1, 0)])
+    return near
+
+class Prefetcher(threading.Thread):
+    """Checks candidate files against the blame cache in the
+    background and reads those that are missing from it.
+    callback(blamed, key, ident) is called from the prefetcher
+    thread for each file to blame; ident is None for a file at
+    a revision. Each file is checked once, until forgotten."""
+    def __init__(self, callback, store=None):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.callback = callback
+        self.store = store
+        self.checked = set()
+        self._requests = deque()
+        self._rev = None
+        self._wakeup = threading.Condition()
+
+    def request(self, files, limit, near=None, skip=()):
+        """Queues the blame of up to limit of files, then of the
+        files next to near, leaving out those in skip. Only a few
+        candidates are checked for each file to blame."""
+        self._wakeup.acquire()
+        try:
+            self._requests.append((list(files), limit, near, set(skip)))
+            self._wakeup.notify()
+        finally:
+            self._wakeup.release()
+
+    def request_rev(self, fil, rev, repo):
+        """Queues the blame of fil as it was in rev of repo,
+        ahead of the other files. It replaces the one of an
+        earlier call that is still waiting."""
+        self._wakeup.acquire()
+        try:
+            self._rev = (fil, rev, repo)
+            self._wakeup.notify()
+        finally:
+            self._wakeup.release()
+
+    def forget(self, fil, rev=None):
+        """Lets fil (at rev) be checked again."""
+        self.checked.discard(rev and (fil, rev) or fil)
+
+    def run(self):
+        while True:
+            self._wakeup.acquire()
+            try:
+                while not self._requests and not self._rev:
+                    self._wakeup.wait()
+                rev, self._rev = self._rev, None
+                request = not rev and self._requests.popleft()
+            finally:
+                self._wakeup.release()
+            if rev:
+                self.prefetch_rev(*rev)
+            else:
+                self.prefetch(*request)
+
+    def prefetch_rev(self, fil, rev, repo):
+        if (fil, rev) in self.checked:
+            return
+        self.checked.add((fil, rev))
+        key = cache.key_for(cache.identify(fil, rev, repo))
+        if not key or cache.contains(key):
+            return
+        try:
+            blamed = BlamedFile(fil, None, self.store, rev, repo)
+        except IOError:
+            return
+        self.callback(blamed, key, None)
+
+    def prefetch(self, files, limit, near, skip):
+        checks = limit * _CHECKS
+        if near:
+            files = files + siblings(near)
+        for fil in files:
+            if limit <= 0 or checks <= 0:
+                break
+            if fil in skip or fil in self.checked or not os.path.isfile(fil):
+                continue
+            self.checked.add(fil)
+            checks -= 1
+            ident = cache.identify(fil)
+            key = cache.key_for(ident)
+            if not key or cache.contains(key):
+                continue
+            try:
+                blamed = BlamedFile(fil, None, self.store)
+            except IOError:
+                continue
+            self.callback(blamed, key, ident)
+            limit -= 1
@@ -0,0 +1,180 @@
+# reblame.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# incremental re-blame: reuses a previous blame of the
+# same path, only blaming the lines that changed since.
+#
+import os, re, tempfile
+from hashlib import sha1
+import gitcmd
+
+MAXRANGES = 256 # -L arguments passed to a single git blame
+_FULLFRACTION = 0.5 # above this fraction of changed lines, blame it all
+_UNCOMMITTED = '0' * 40
+
+_hunkheader = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+def _count(count):
+    # a missing count in a hunk header means one line
+    if count is None:
+        return 1
+    return int(count)
+
+def blob_id(data):
+    """Returns the sha1 git gives a blob of data."""
+    return sha1("blob %d\0%s" % (len(data), data)).hexdigest()
+
+def diff_ranges(repo, blob, fil, old=None):
+    """Diffs the blob against the working tree file fil.
+    Returns a list of (old_start, old_count, new_start, new_count)
+    like the hunk headers of a unified diff, or None if the blob
+    is not available. old is the content of the blob if known,
+    as git does not store the working tree content it blamed."""
+    if old is None or blob_id(old) != blob:
+        old = gitcmd.output("cat-file", "blob", blob, cwd=repo)
+    if old is None:
+        return None
+    fd, tmpname = tempfile.mkstemp(prefix='git-age')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(old)
+        finally:
+            f.close()
+        out = gitcmd.output("diff", "--no-index", "--no-color", "--no-ext-diff",
+                            "--no-textconv", "-U0", "--", tmpname, os.path.abspath(fil),
+                            cwd=repo, ok=(0, 1))
+    finally:
+        os.remove(tmpname)
+    if out is None:
+        return None
+    ranges = []
+    for line in out.splitlines():
+        m = _hunkheader.match(line)
+        if m:
+            ranges.append((int(m.group(1)), _count(m.group(2)),
+                           int(m.group(3)), _count(m.group(4))))
+    return ranges
+
+def is_ancestor(repo, old, new):
+    """Checks that commit old is in the history of new."""
+    return gitcmd.output("merge-base", "--is-ancestor", old, new, cwd=repo) is not None
+
+def shift_hunks(hunks, diff):
+    """Moves the old hunks (commit, sourceline, resultline, num_lines)
+    to their place in the new file, dropping the lines removed
+    or replaced by the diff."""
+    # removed old line ranges, and the line offset after each of them
+    removed = []
+    offset = 0
+    for old_start, old_count, new_start, new_count in diff:
+        if old_count == 0:
+            # pure insertion after old_start
+            first = old_start + 1
+        else:
+            first = old_start
+        offset += new_count - old_count
+        removed.append((first, first + old_count, offset))
+
+    shifted = []
+    r = 0
+    current = 0
+    for commit, sourceline, resultline, num_lines in sorted(hunks, key=lambda h: h[2]):
+        start = resultline
+        end = resultline + num_lines
+        while start < end:
+            # skip removed ranges that end before this piece
+            while r < len(removed) and removed[r][1] <= start and removed[r][0] <= start:
+                current = removed[r][2]
+                r += 1
+            if r < len(removed) and removed[r][0] <= start:
+                # inside a removed range
+                start = min(end, removed[r][1])
+                continue
+            stop = end
+            if r < len(removed):
+                stop = min(end, removed[r][0])
+            shifted.append((commit, sourceline + (start - resultline), start + current, stop - start))
+            start = stop
+    return shifted
+
+def subtract(hunks, ranges):
+    """Removes the lines in the sorted, disjoint ranges
+    [(first, last)] from hunks sorted by resultline."""
+    result = []
+    r = 0
+    for commit, sourceline, resultline, num_lines in hunks:
+        start = resultline
+        end = resultline + num_lines
+        while r < len(ranges) and ranges[r][1] < start:
+            r += 1
+        k = r
+        while start < end:
+            if k < len(ranges) and ranges[k][0] < end:
+                first, last = ranges[k]
+                if first > start:
+                    result.append((commit, sourceline + (start - resultline), start, first - start))
+                start = max(start, last + 1)
+                k += 1
+            else:
+                result.append((commit, sourceline + (start - resultline), start, end - start))
+                break
+    return result
+
+def coalesce(ranges, maxranges=MAXRANGES):
+    """Sorts and merges overlapping line ranges [(first, last)],
+    then joins the closest ranges until at most maxranges are left."""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    while len(merged) > maxranges:
+        gaps = sorted((merged[i+1][0] - merged[i][1], i) for i in range(len(merged) - 1))
+        join = set(i for _, i in gaps[:len(merged) - maxranges])
+        joined = []
+        for i, r in enumerate(merged):
+            if i - 1 in join:
+                joined[-1] = (joined[-1][0], r[1])
+            else:
+                joined.append(r)
+        merged = joined
+    return merged
+
+def prepare(blamed, previous, data, ident, text=None):
+    """Fills blamed with the still valid hunks from a previous blame.
+    previous is the identity (see cache.identify) and data the
+    dump of the previous blame, ident the identity of blamed,
+    text the content blamed then, if known.
+    Returns the list of (first, last) line ranges that still have
+    to be blamed, or None if a full blame is needed."""
+    if previous['repo'] != ident['repo'] or previous['path'] != ident['path']:
+        return None
+    if previous['head'] != ident['head'] and not is_ancestor(ident['repo'], previous['head'], ident['head']):
+        # after a checkout or rebase elsewhere, unchanged lines
+        # may come from other commits
+        return None
+    diff = diff_ranges(ident['repo'], previous['blob'], blamed.fil, text)
+    if diff is None:
+        return None
+    num_lines = blamed.num_lines
+    hunks = shift_hunks(data['hunks'], diff)
+    ranges = [(new_start, new_start + new_count - 1)
+              for _, _, new_start, new_count in diff if new_count > 0]
+    if previous['head'] != ident['head']:
+        # uncommitted lines may have been committed since
+        for i, sourceline, resultline, count in hunks:
+            if data['commits'][i]['sha1'] == _UNCOMMITTED:
+                ranges.append((resultline, resultline + count - 1))
+    ranges = coalesce(ranges)
+    if sum(last - first + 1 for first, last in ranges) > num_lines * _FULLFRACTION:
+        return None
+
+    commits = [blamed.add_commit(attrs) for attrs in data['commits']]
+    for i, sourceline, resultline, count in subtract(hunks, ranges):
+        if resultline + count - 1 <= num_lines:
+            blamed.add_hunk(commits[i], sourceline, resultline, count)
+    return ranges
@@ -0,0 +1,175 @@
+# report.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# headless batch mode: blames many files in a
+# process pool and writes JSON or CSV reports.
+#
+import sys, os, glob, csv
+import multiprocessing
+from functools import partial
+from optparse import OptionParser
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import gitcmd
+import cache
+from blame import BlamedFile
+
+def expand(paths):
+    """Yields the files named by paths, expanding globs
+    and listing the files tracked by git in directories."""
+    for path in paths:
+        matches = glob.glob(path) or [path]
+        for match in sorted(matches):
+            if os.path.isdir(match):
+                out = gitcmd.output("ls-files", "-z", cwd=match)
+                for name in (out or '').split('\0'):
+                    if name:
+                        yield os.path.join(match, name)
+            else:
+                yield match
+
+def blame_file(fil, use_cache=True):
+    """Blames fil and returns a picklable summary: the
+    commits and hunks, or the error if blaming failed.
+    Results are shared with the on-disk blame cache."""
+    try:
+        blamed = BlamedFile(fil)
+        ident = use_cache and cache.identify(fil) or None
+        key = cache.key_for(ident)
+        data = cache.load(key)
+        if data:
+            blamed.load(data)
+        else:
+            blamed.run()
+            if not blamed.error and blamed.commits:
+                cache.store(key, blamed.dump(), ident)
+    except (IOError, OSError), e:
+        return {'file': fil, 'error': str(e)}
+    except Exception, e:
+        # one file that cannot be blamed does not end the report
+        return {'file': fil, 'error': '%s: %s' % (e.__class__.__name__, e)}
+    if blamed.error or not blamed.commits:
+        return {'file': fil, 'error': blamed.error or 'no lines to blame'}
+    return {'file': fil,
+            'num_lines': blamed.num_lines,
+            'commits': [(c.sha1, c.author, c.author_mail, c.author_time, blamed.ages[i])
+                        for i, c in enumerate(blamed.commits)],
+            'hunks': [(blamed.hunk_commit[h], blamed.hunk_start[h], blamed.hunk_len[h])
+                      for h in blamed.hunk_indices()]}
+
+def summarize(result):
+    """Per-file statistics from a blame_file() result."""
+    commits = result['commits']
+    authors = {}
+    total = 0
+    weighted = 0
+    for c, start, count in result['hunks']:
+        sha1, author, mail, when, age = commits[c]
+        authors[author] = authors.get(author, 0) + count
+        weighted += age * count
+        total += count
+    return {'file': result['file'],
+            'lines': total,
+            'commits': len(commits),
+            'mean_age': total and float(weighted) / total or 0.0,
+            'authors': authors}
+
+def lines(result):
+    """Yields (line, author, commit, author_time, age)
+    for every line of a blame_file() result."""
+    commits = result['commits']
+    for c, start, count in sorted(result['hunks'], key=lambda h: h[1]):
+        sha1, author, mail, when, age = commits[c]
+        for line in range(start, start + count):
+            yield line, author, sha1, when, age
+
+class JSONWriter(object):
+    """Writes one JSON object per file and line."""
+    def __init__(self, out, per_line):
+        self.out = out
+        self.per_line = per_line
+
+    def write(self, result):
+        if 'error' in result:
+            record = {'file': result['file'], 'error': result['error']}
+        else:
+            record = summarize(result)
+            if self.per_line:
+                record['lines_detail'] = [
+                    {'line': line, 'author': author, 'commit': sha1,
+                     'author_time': when, 'age': age}
+                    for line, author, sha1, when, age in lines(result)]
+        self.out.write(json.dumps(record) + '\n')
+
+class CSVWriter(object):
+    """Writes one CSV row per file, or per line."""
+    def __init__(self, out, per_line):
+        self.writer = csv.writer(out)
+        self.per_line = per_line
+        if per_line:
+            self.writer.writerow(['file', 'line', 'author', 'commit', 'author_time', 'age'])
+        else:
+            self.writer.writerow(['file', 'lines', 'commits', 'mean_age', 'top_author', 'error'])
+
+    def write(self, result):
+        fil = result['file']
+        if 'error' in result:
+            if not self.per_line:
+                self.writer.writerow([fil, 0, 0, '', '', result['error']])
+            return
+        if self.per_line:
+            for line, author, sha1, when, age in lines(result):
+                self.writer.writerow([fil, line, author, sha1, when, age])
+        else:
+            stats = summarize(result)
+            top = max(stats['authors'].iteritems(), key=lambda a: a[1])[0]
+            self.writer.writerow([fil, stats['lines'], stats['commits'],
+                                  '%.1f' % stats['mean_age'], top, ''])
+
+def main(args):
+    parser = OptionParser(usage="%prog --report [options] <path|glob>...")
+    parser.add_option("-f", "--format", default="json", choices=["json", "csv"],
+                      help="output format: json (default) or csv")
+    parser.add_option("-l", "--lines", action="store_true", default=False,
+                      help="report every line, not only per file")
+    parser.add_option("-j", "--jobs", type="int", default=multiprocessing.cpu_count(),
+                      help="number of files blamed at once (default: all cores)")
+    parser.add_option("-o", "--output", help="write to this file instead of stdout")
+    parser.add_option("--no-cache", action="store_false", dest="cache", default=True,
+                      help="do not read or write the blame cache")
+    options, paths = parser.parse_args(args)
+    if not paths:
+        parser.error("no paths given")
+
+    out = sys.stdout
+    if options.output:
+        out = open(options.output, 'wb')
+    if options.format == 'csv':
+        writer = CSVWriter(out, options.lines)
+    else:
+        writer = JSONWriter(out, options.lines)
+
+    failed = 0
+    pool = multiprocessing.Pool(max(options.jobs, 1))
+    try:
+        # results are written as soon as each file is done
+        work = partial(blame_file, use_cache=options.cache)
+        for result in pool.imap_unordered(work, expand(paths), 4):
+            writer.write(result)
+            if 'error' in result:
+                failed += 1
+                sys.stderr.write("%s: %s\n" % (result['file'], result['error']))
+        pool.close()
+    except BaseException:
+        # join() only waits for a closed or terminated pool
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        if out is not sys.stdout:
+            out.close()
+    return failed and 1 or 0
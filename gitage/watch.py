@@ -0,0 +1,186 @@
+# watch.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# notices changes to files: through inotify where the
+# C library has it, by polling their status otherwise.
+#
+import os, errno, struct
+import gitcmd
+try:
+    import ctypes, ctypes.util
+except ImportError:
+    ctypes = None
+
+# inotify(7)
+_IN_MODIFY = 0x2
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_CLOEXEC = 0x80000
+_EVENT = struct.Struct('iIII') # wd, mask, cookie, len
+
+# editors and git replace files by renaming over them, so the
+# directories are watched rather than the files
+_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+class _Watcher(object):
+    """Counts how often each path is watched, as files
+    share their repository's HEAD."""
+    def __init__(self):
+        self._paths = {}
+
+    def add(self, path):
+        path = os.path.abspath(path)
+        if path not in self._paths:
+            self._watch(path)
+        self._paths[path] = self._paths.get(path, 0) + 1
+
+    def remove(self, path):
+        path = os.path.abspath(path)
+        count = self._paths.get(path, 0) - 1
+        if count > 0:
+            self._paths[path] = count
+        elif count == 0:
+            del self._paths[path]
+            self._unwatch(path)
+
+class Inotify(_Watcher):
+    """Watches paths with inotify. fileno() turns readable
+    when one changes; changed() then tells which."""
+    def __init__(self):
+        _Watcher.__init__(self)
+        if not ctypes:
+            raise OSError(errno.ENOSYS, "no ctypes")
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._fd = fd
+        self._wds = {} # directory -> watch descriptor
+        self._dirs = {} # watch descriptor -> directory
+        self._names = {} # directory -> names watched in it
+
+    def _watch(self, path):
+        directory, name = os.path.split(path)
+        if directory not in self._wds:
+            wd = self._libc.inotify_add_watch(self._fd, directory, _MASK)
+            if wd < 0:
+                # not there (yet), as the ref of a new branch
+                return
+            self._wds[directory] = wd
+            self._dirs[wd] = directory
+        self._names.setdefault(directory, set()).add(name)
+
+    def _unwatch(self, path):
+        directory, name = os.path.split(path)
+        names = self._names.get(directory)
+        if names is None:
+            return
+        names.discard(name)
+        if not names:
+            del self._names[directory]
+            wd = self._wds.pop(directory)
+            del self._dirs[wd]
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def fileno(self):
+        return self._fd
+
+    def changed(self):
+        """Reads the pending events. Returns the set of
+        watched paths that changed."""
+        paths = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip('\0')
+                offset += length
+                if mask & _IN_Q_OVERFLOW:
+                    # events were lost; anything may have changed
+                    paths.update(self._paths)
+                    continue
+                directory = self._dirs.get(wd)
+                if directory is not None and name in self._names.get(directory, ()):
+                    paths.add(os.path.join(directory, name))
+        return paths
+
+    def close(self):
+        os.close(self._fd)
+
+def _status(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size, st.st_ino
+
+class Poller(_Watcher):
+    """Watches paths by comparing their status each time
+    changed() is called. Has no fileno()."""
+    def __init__(self):
+        _Watcher.__init__(self)
+        self._status = {}
+
+    def _watch(self, path):
+        self._status[path] = _status(path)
+
+    def _unwatch(self, path):
+        del self._status[path]
+
+    def fileno(self):
+        return None
+
+    def changed(self):
+        paths = set()
+        for path, old in self._status.items():
+            new = _status(path)
+            if new != old:
+                self._status[path] = new
+                paths.add(path)
+        return paths
+
+    def close(self):
+        pass
+
+def watcher():
+    """Returns an Inotify watcher, or a Poller where
+    inotify is not available."""
+    try:
+        return Inotify()
+    except (OSError, AttributeError):
+        return Poller()
+
+def head_paths(cwd):
+    """Returns the files git rewrites on a commit or checkout
+    in the repository at cwd: HEAD, the branch it is on, and
+    packed-refs."""
+    gitdir = gitcmd.output("rev-parse", "--git-dir", cwd=cwd)
+    if not gitdir:
+        return []
+    gitdir = os.path.join(cwd, gitdir.strip())
+    # worktrees keep their refs in the main repository
+    common = gitcmd.output("rev-parse", "--git-common-dir", cwd=cwd)
+    if common:
+        common = os.path.join(cwd, common.strip())
+    else:
+        common = gitdir
+    paths = [os.path.join(gitdir, 'HEAD'), os.path.join(common, 'packed-refs')]
+    ref = gitcmd.output("symbolic-ref", "-q", "HEAD", cwd=cwd)
+    if ref:
+        paths.append(os.path.join(common, *ref.strip().split('/')))
+    return [os.path.normpath(path) for path in paths]
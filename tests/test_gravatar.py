@@ -0,0 +1,89 @@
+# test_gravatar.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# tests of the gravatar fetcher against a local server.
+#
+import os, shutil, tempfile, threading, unittest
+import BaseHTTPServer, SocketServer
+from gitage import gravatar
+
+IMAGE = 'GIF89a' + '\0' * 64
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    paths = []
+
+    def do_GET(self):
+        _Handler.paths.append(self.path)
+        if self.path.startswith('/loop/'):
+            self.redirect(self.path)
+        elif self.path.startswith('/moved/'):
+            # a relative Location, as gravatar.com sends
+            self.redirect('/avatar/' + self.path[len('/moved/'):])
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/gif')
+            self.send_header('Content-Length', str(len(IMAGE)))
+            self.end_headers()
+            self.wfile.write(IMAGE)
+
+    def redirect(self, location):
+        self.send_response(301)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+class RedirectTest(unittest.TestCase):
+    def setUp(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.home = tempfile.mkdtemp(prefix='git-age-test')
+        self.oldhome = os.environ.get('HOME')
+        os.environ['HOME'] = self.home
+        self.oldurl = gravatar._BASEURL
+        _Handler.paths = []
+
+    def tearDown(self):
+        if self.oldhome is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = self.oldhome
+        gravatar.set_baseurl(self.oldurl)
+        gravatar.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def baseurl(self, path):
+        return 'http://127.0.0.1:%d/%s/' % (self.server.server_port, path)
+
+    def test_redirect(self):
+        gravatar.set_baseurl(self.baseurl('moved'))
+        filename = gravatar.get('redirected@example.com')
+        f = open(filename, 'rb')
+        try:
+            self.assertEqual(f.read(), IMAGE)
+        finally:
+            f.close()
+        self.assertEqual([path.split('/')[1] for path in _Handler.paths], ['moved', 'avatar'])
+
+    def test_redirect_loop(self):
+        gravatar.set_baseurl(self.baseurl('loop'))
+        self.assertRaises(IOError, gravatar.get, 'looping@example.com')
+        self.assertEqual(len(_Handler.paths), gravatar._MAXREDIRECTS + 1)
+
+if __name__ == '__main__':
+    unittest.main()
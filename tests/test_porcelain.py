@@ -0,0 +1,77 @@
+# test_porcelain.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# tests of the git blame output parser:
+#
+#   python -m unittest discover tests
+#
+import unittest
+from gitage.porcelain import HunkParser
+
+SHA1 = 'a' * 40
+OTHER = 'b' * 40
+# summary lines with a space as their 41st character, like a header
+SUMMARY = 'summary Update the copyright year of the docs to 2009'
+# ... and four fields
+SUMMARY4 = 'summary Merge-branch-maint-into-release1 2 1'
+
+INCREMENTAL = '\n'.join([
+    '%s 1 1 2' % SHA1,
+    'author A U Thor',
+    'author-time 1200000000',
+    SUMMARY,
+    'filename f.txt',
+    '%s 3 3 1' % OTHER,
+    'author Other',
+    SUMMARY4,
+    'filename f.txt',
+    '%s 4 4 1' % SHA1,
+    'filename f.txt',
+    ''])
+
+PORCELAIN = '\n'.join([
+    '%s 1 1 2' % SHA1,
+    'author A U Thor',
+    SUMMARY,
+    'filename f.txt',
+    '\tline 1',
+    '%s 2 2' % SHA1,
+    '\tline 2',
+    '%s 3 3 1' % OTHER,
+    'author Other',
+    SUMMARY4,
+    'filename f.txt',
+    '\tline 3',
+    '%s 4 4 1' % SHA1,
+    '\tline 4',
+    ''])
+
+def parse(data, chunksize):
+    parser = HunkParser()
+    hunks = []
+    for i in range(0, len(data), chunksize):
+        hunks.extend(parser.feed(data[i:i + chunksize]))
+    hunks.extend(parser.close())
+    return hunks
+
+class HunkParserTest(unittest.TestCase):
+    def check(self, data):
+        for chunksize in (1, 7, len(data)):
+            hunks = parse(data, chunksize)
+            self.assertEqual([h[:4] for h in hunks],
+                             [(SHA1, 1, 1, 2), (OTHER, 3, 3, 1), (SHA1, 4, 4, 1)])
+            self.assertEqual(hunks[0][4]['summary'], SUMMARY[len('summary '):])
+            self.assertEqual(hunks[0][4]['author'], 'A U Thor')
+            self.assertEqual(hunks[1][4]['author'], 'Other')
+            self.assertEqual(hunks[1][4]['summary'], SUMMARY4[len('summary '):])
+
+    def test_incremental(self):
+        self.check(INCREMENTAL)
+
+    def test_porcelain(self):
+        self.check(PORCELAIN)
+
+if __name__ == '__main__':
+    unittest.main()
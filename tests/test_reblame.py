@@ -0,0 +1,138 @@
+# test_reblame.py  Copyright (C) 2008  Kristoffer Gronlund
+#    This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+#    This is free software, and you are welcome to redistribute it
+#    under certain conditions; see LICENSE for details.
+#
+# tests of the line range arithmetic of incremental re-blame.
+#
+import unittest
+from gitage import reblame
+
+# commit 0 blamed for lines 1-3 (from its line 10),
+# commit 1 for lines 4-6 (from its line 20)
+HUNKS = [(0, 10, 1, 3), (1, 20, 4, 3)]
+
+# diff (old_start, old_count, new_start, new_count) -> shifted HUNKS
+SHIFTS = [
+    ([], HUNKS),
+    # insertions before, between and after the hunks
+    ([(0, 0, 1, 1)], [(0, 10, 2, 3), (1, 20, 5, 3)]),
+    ([(3, 0, 4, 2)], [(0, 10, 1, 3), (1, 20, 6, 3)]),
+    ([(6, 0, 7, 1)], HUNKS),
+    # deletions of the first and last line of a hunk, and across both
+    ([(1, 1, 0, 0)], [(0, 11, 1, 2), (1, 20, 3, 3)]),
+    ([(3, 1, 2, 0)], [(0, 10, 1, 2), (1, 20, 3, 3)]),
+    ([(4, 1, 3, 0)], [(0, 10, 1, 3), (1, 21, 4, 2)]),
+    ([(3, 2, 2, 0)], [(0, 10, 1, 2), (1, 21, 3, 2)]),
+    ([(6, 1, 5, 0)], [(0, 10, 1, 3), (1, 20, 4, 2)]),
+    # a line replaced by two splits its hunk
+    ([(5, 1, 5, 2)], [(0, 10, 1, 3), (1, 20, 4, 1), (1, 22, 7, 1)]),
+    # several changes add up their offsets
+    ([(1, 1, 0, 0), (3, 0, 3, 2), (6, 1, 7, 0)],
+     [(0, 11, 1, 2), (1, 20, 5, 2)]),
+    # everything removed
+    ([(1, 6, 0, 0)], []),
+]
+
+# ranges -> HUNKS without those lines
+SUBTRACTS = [
+    ([], HUNKS),
+    ([(2, 2)], [(0, 10, 1, 1), (0, 12, 3, 1), (1, 20, 4, 3)]),
+    ([(3, 4)], [(0, 10, 1, 2), (1, 21, 5, 2)]),
+    ([(1, 3)], [(1, 20, 4, 3)]),
+    ([(1, 1), (6, 6)], [(0, 11, 2, 2), (1, 20, 4, 2)]),
+    ([(1, 6)], []),
+    ([(7, 9)], HUNKS),
+]
+
+# (ranges, maxranges) -> coalesced ranges
+COALESCES = [
+    (([], 4), []),
+    (([(5, 6), (1, 2), (3, 3)], 4), [(1, 3), (5, 6)]),
+    (([(1, 5), (2, 3)], 4), [(1, 5)]),
+    (([(1, 1), (3, 3), (10, 10), (12, 12)], 4), [(1, 1), (3, 3), (10, 10), (12, 12)]),
+    # the closest ranges are joined first
+    (([(1, 1), (3, 3), (10, 10), (12, 12)], 3), [(1, 3), (10, 10), (12, 12)]),
+    (([(1, 1), (3, 3), (10, 10), (12, 12)], 2), [(1, 3), (10, 12)]),
+    (([(1, 1), (3, 3), (10, 10), (12, 12)], 1), [(1, 12)]),
+]
+
+class _Blamed(object):
+    """Records the hunks prepare() keeps."""
+    def __init__(self, num_lines):
+        self.fil = 'f.txt'
+        self.num_lines = num_lines
+        self.hunks = []
+
+    def add_commit(self, attrs):
+        return attrs['sha1']
+
+    def add_hunk(self, commit, sourceline, resultline, num_lines):
+        self.hunks.append((commit, sourceline, resultline, num_lines))
+
+def _ident(head, blob):
+    return {'repo': '/repo', 'path': 'f.txt', 'head': head, 'blob': blob}
+
+COMMITTED = 'c' * 40
+DATA = {'commits': [{'sha1': COMMITTED}, {'sha1': reblame._UNCOMMITTED}],
+        'hunks': [(0, 1, 1, 8), (1, 9, 9, 2)]}
+
+class RangeTest(unittest.TestCase):
+    def test_shift_hunks(self):
+        for diff, shifted in SHIFTS:
+            self.assertEqual(reblame.shift_hunks(HUNKS, diff), shifted, diff)
+
+    def test_subtract(self):
+        for ranges, left in SUBTRACTS:
+            self.assertEqual(reblame.subtract(HUNKS, ranges), left, ranges)
+
+    def test_coalesce(self):
+        for (ranges, maxranges), merged in COALESCES:
+            self.assertEqual(reblame.coalesce(ranges, maxranges), merged, (ranges, maxranges))
+
+    def test_coalesce_default(self):
+        ranges = [(y, y) for y in range(1, 3 * reblame.MAXRANGES, 2)]
+        merged = reblame.coalesce(ranges)
+        self.assertEqual(len(merged), reblame.MAXRANGES)
+        self.assertEqual((merged[0][0], merged[-1][1]), (ranges[0][0], ranges[-1][1]))
+
+class PrepareTest(unittest.TestCase):
+    def setUp(self):
+        self.diff_ranges = reblame.diff_ranges
+        self.is_ancestor = reblame.is_ancestor
+        self.diff = []
+        self.ancestor = True
+        reblame.diff_ranges = lambda repo, blob, fil, old=None: self.diff
+        reblame.is_ancestor = lambda repo, old, new: self.ancestor
+
+    def tearDown(self):
+        reblame.diff_ranges = self.diff_ranges
+        reblame.is_ancestor = self.is_ancestor
+
+    def prepare(self, head='h1', num_lines=10):
+        blamed = _Blamed(num_lines)
+        ranges = reblame.prepare(blamed, _ident('h1', 'b1'), DATA, _ident(head, 'b2'))
+        return ranges, blamed.hunks
+
+    def test_unchanged(self):
+        self.assertEqual(self.prepare(), ([], [(COMMITTED, 1, 1, 8), (reblame._UNCOMMITTED, 9, 9, 2)]))
+
+    def test_edit(self):
+        self.diff = [(2, 1, 2, 1)]
+        self.assertEqual(self.prepare(), ([(2, 2)], [(COMMITTED, 1, 1, 1), (COMMITTED, 3, 3, 6),
+                                                     (reblame._UNCOMMITTED, 9, 9, 2)]))
+
+    def test_commit(self):
+        # the uncommitted lines are blamed again after a commit
+        self.assertEqual(self.prepare('h2'), ([(9, 10)], [(COMMITTED, 1, 1, 8)]))
+
+    def test_other_branch(self):
+        self.ancestor = False
+        self.assertEqual(self.prepare('h2'), (None, []))
+
+    def test_mostly_changed(self):
+        self.diff = [(1, 6, 1, 6)]
+        self.assertEqual(self.prepare(), (None, []))
+
+if __name__ == '__main__':
+    unittest.main()